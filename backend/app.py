@@ -5,23 +5,26 @@ from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import requests
 import json
+import hashlib
+import re
 import itertools # Import itertools for cycling through keys
 import pikepdf
 import io
 import os
 import tempfile
 import shutil
-from flask import send_file, make_response
+from flask import send_file, make_response, after_this_request, Response
 from PIL import Image, ImageDraw
 import fitz  # PyMuPDF
 from reportlab.lib.pagesizes import A4, LETTER, LEGAL, A3
 from reportlab.lib.units import inch
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
+import math
+import time
 import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from werkzeug.utils import secure_filename
-from PyPDF2 import PdfReader
-from pdf2image import convert_from_bytes
 import pytesseract
 from docx import Document
 from docx.shared import Inches
@@ -35,6 +38,11 @@ load_dotenv()
 
 # Now import supabase client
 from supabase_client import create_supabase_client, handle_supabase_error
+from file_cache import DiskCache, hash_file, make_cache_key
+from job_queue import JobQueue, JobQueueFull
+from host_semaphore import HostSemaphore
+from docx_stream import StreamingDocxWriter
+from pdf_stream import StreamingImagePdfWriter
 
 app = Flask(__name__, static_folder='../frontend', static_url_path='')
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key')
@@ -112,6 +120,48 @@ else:
     current_picsart_api_key = next(current_picsart_api_key_iterator)
     print(f"Initialized Picsart API keys. Starting with: {current_picsart_api_key[:5]}...")
 
+# --- Result Cache Setup ---
+# Finished PDF/conversion outputs, keyed by upload hash + normalized parameters
+result_cache = DiskCache(
+    os.environ.get('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'oneclick_results')),
+    max_bytes=int(os.environ.get('RESULT_CACHE_MAX_MB', 512)) * 1024 * 1024,
+    ttl=int(os.environ.get('RESULT_CACHE_TTL', 24 * 3600))
+)
+if result_cache.enabled:
+    print(f"Result cache enabled at {result_cache.directory}")
+
+# --- Rendered Page Cache Setup ---
+# Pages rasterized by any endpoint, as lossless PNG, keyed by document hash + page + DPI + colorspace
+page_cache = DiskCache(
+    os.environ.get('PAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'oneclick_pages')),
+    max_bytes=int(os.environ.get('PAGE_CACHE_MAX_MB', 256)) * 1024 * 1024,
+    ttl=int(os.environ.get('PAGE_CACHE_TTL', 24 * 3600))
+)
+if page_cache.enabled:
+    print(f"Rendered page cache enabled at {page_cache.directory}")
+
+# --- Background Job Setup ---
+# Opt-in async mode for the heavy endpoints: work runs on a local process pool
+jobs = JobQueue(
+    os.environ.get('JOB_DIR', os.path.join(tempfile.gettempdir(), 'oneclick_jobs')),
+    workers=int(os.environ.get('JOB_WORKERS', 2)),
+    max_pending=int(os.environ.get('JOB_MAX_PENDING', 8)),
+    ttl=int(os.environ.get('JOB_RESULT_TTL', 3600))
+)
+
+# --- OCR Setup ---
+# Tesseract reads pages without a text layer in PDF to Word. Lock-file slots
+# bound how many tesseract processes run at once across every worker on the host
+OCR_DPI = int(os.environ.get('OCR_DPI', 300))
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', os.cpu_count() or 1))
+OCR_LANGUAGES = [lang.strip() for lang in os.environ.get('OCR_LANGUAGES', 'eng,spa,fra,deu,ita,chi_sim').split(',') if lang.strip()]
+ocr_slots = HostSemaphore(
+    os.environ.get('OCR_SLOT_DIR', os.path.join(tempfile.gettempdir(), 'oneclick_ocr_slots')),
+    slots=int(os.environ.get('OCR_MAX_CONCURRENT', os.cpu_count() or 1))
+)
+# Each tesseract run gets one thread to match its slot (inherited by the processes it starts from here)
+os.environ['OMP_THREAD_LIMIT'] = '1'
+
 
 @app.after_request
 def after_request(response):
@@ -622,9 +672,6 @@ def enhance_image():
     if 'user' not in session:
         return jsonify({"success": False, "message": "Authentication required to enhance images."}), 401
 
-    global current_picsart_api_key_iterator
-    global current_picsart_api_key
-
     if not PICSART_API_KEYS: # Check the list directly, not the iterator
         return jsonify({"success": False, "message": "Server configuration error: Picsart API keys are not set."}), 500
 
@@ -635,17 +682,36 @@ def enhance_image():
     upscale_factor = request.form.get('upscale_factor', '2')
     output_format = request.form.get('format', 'JPG')
 
+    try:
+        # Spool the upload so every key attempt (and a background job) can resend it
+        args = lambda image_path, workdir: (image_path, image_file.filename, image_file.content_type, upscale_factor, output_format)
+        return dispatch_upload(
+            'enhance-image', image_file, run_enhance_image, args,
+            respond=lambda payload, status: (jsonify(payload), status),
+            job_func=run_enhance_image_job,
+            spool_name='upload' + os.path.splitext(secure_filename(image_file.filename or ''))[1]
+        )
+
+    except Exception as e:
+        print(f"Error in enhance_image: {e}")
+        return jsonify({"success": False, "message": "An internal server error occurred during image enhancement."}), 500
+
+
+def run_enhance_image(image_path, filename, content_type, upscale_factor, output_format, progress=None):
+    """Send a spooled image to the Picsart enhance API, rotating keys; returns {'payload', 'status'}"""
+    global current_picsart_api_key_iterator
+    global current_picsart_api_key
+
     picsart_url = "https://api.picsart.io/tools/1.0/upscale/enhance"
 
-    # Prepare multipart/form-data
-    files = {
-        'image': (image_file.filename, image_file.stream, image_file.content_type)
-    }
     data = {
         'upscale_factor': upscale_factor,
         'format': output_format
     }
 
+    if progress:
+        progress(0, 1)
+
     # Loop to try all available keys
     for _ in range(len(PICSART_API_KEYS)): # Iterate through all available keys
         headers = {
@@ -656,7 +722,12 @@ def enhance_image():
         print(f"Calling Picsart API with key: {current_picsart_api_key[:5]}...")
 
         try:
-            picsart_response = requests.post(picsart_url, files=files, data=data, headers=headers, timeout=180)
+            # Prepare multipart/form-data, reopening the upload for each attempt
+            with open(image_path, 'rb') as image_stream:
+                files = {
+                    'image': (filename, image_stream, content_type)
+                }
+                picsart_response = requests.post(picsart_url, files=files, data=data, headers=headers, timeout=180)
             
             # Check for HTTP errors first
             picsart_response.raise_for_status() 
@@ -685,31 +756,42 @@ def enhance_image():
             else:
                 # Re-raise other HTTP errors
                 print(f"Picsart API Error: {e.response.status_code} - {e.response.text}")
-                return jsonify({"success": False, "message": f"Picsart API error: {error_message}"}), e.response.status_code
+                return {'payload': {"success": False, "message": f"Picsart API error: {error_message}"}, 'status': e.response.status_code}
         except StopIteration:
             # This should ideally not happen with the for loop, but as a safeguard
             print("No more Picsart API keys available in the cycle.")
-            return jsonify({"success": False, "message": "All Picsart API keys are rate-limited or exhausted."}), 503
+            return {'payload': {"success": False, "message": "All Picsart API keys are rate-limited or exhausted."}, 'status': 503}
         except requests.exceptions.RequestException as e:
             print(f"Network or connection error during Picsart API call: {e}")
-            return jsonify({"success": False, "message": "A network error occurred while connecting to the image enhancement service."}), 500
+            return {'payload': {"success": False, "message": "A network error occurred while connecting to the image enhancement service."}, 'status': 500}
         except Exception as e:
             print(f"Error in enhance_image: {e}")
-            return jsonify({"success": False, "message": "An internal server error occurred during image enhancement."}), 500
+            return {'payload': {"success": False, "message": "An internal server error occurred during image enhancement."}, 'status': 500}
+
+    if progress:
+        progress(1, 1)
 
     # After the loop, check if a successful response was obtained
     if 'picsart_data' in locals() and picsart_data.get('status') == 'success' and 'data' in picsart_data and 'url' in picsart_data['data']:
-        return jsonify({
+        return {'payload': {
             "success": True,
             "message": "Image enhanced successfully!",
             "enhanced_image_url": picsart_data['data']['url']
-        }), 200
+        }, 'status': 200}
     else:
         # If loop finished without success, it means all keys failed or the last one failed in a non-rotatable way
         final_error_message = "All Picsart API keys are exhausted or invalid. Please check your API keys or try again later."
         if 'picsart_data' in locals() and picsart_data.get('message'):
             final_error_message = picsart_data.get('message')
-        return jsonify({"success": False, "message": final_error_message}), 500
+        return {'payload': {"success": False, "message": final_error_message}, 'status': 500}
+
+
+def run_enhance_image_job(*args, progress=None):
+    """Background-job wrapper for run_enhance_image: an unsuccessful call fails the job"""
+    result = run_enhance_image(*args, progress=progress)
+    if not result['payload'].get('success'):
+        raise RuntimeError(result['payload'].get('message'))
+    return result
 
 
 
@@ -866,6 +948,175 @@ def parse_model_response(response_data, model):
 
 # ... (rest of your existing app.py code) ...
 
+def result_cache_key(endpoint, digests, params):
+    """Cache key for an endpoint result: SHA-256 of every upload plus the normalized parameters"""
+    return make_cache_key(endpoint, digests, params)
+
+
+def make_request_workdir():
+    """Create a temp directory for this request's files, removed once the response has been sent"""
+    workdir = tempfile.mkdtemp(prefix='oneclick_')
+
+    @after_this_request
+    def cleanup_workdir(response):
+        response.call_on_close(lambda: shutil.rmtree(workdir, ignore_errors=True))
+        return response
+
+    return workdir
+
+
+def spool_upload(file_storage, workdir, name='upload.pdf'):
+    """Stream an uploaded file to disk instead of reading it into memory"""
+    path = os.path.join(workdir, name)
+    file_storage.save(path)
+    return path
+
+
+def send_result(content, meta, mimetype, download_name, headers):
+    """Send a result (cached file path, bytes or a generator of chunks) as a download, answering If-None-Match with 304"""
+    etag = meta.get('etag') if meta else None
+    expose_headers = list(headers)
+
+    if etag and request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    elif isinstance(content, str):
+        response = make_response(send_file(
+            content,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+            etag=etag or False
+        ))
+    elif isinstance(content, bytes):
+        response = make_response(send_file(
+            io.BytesIO(content),
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name
+        ))
+    else:
+        # Produced while it is sent, so there is no length or ETag up front
+        response = Response(content, mimetype=mimetype)
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+
+    if etag:
+        response.set_etag(etag)
+        expose_headers.append('ETag')
+    for name, value in headers.items():
+        response.headers[name] = value
+    response.headers['Access-Control-Expose-Headers'] = ', '.join(expose_headers)
+    return response
+
+
+def streamed_result(chunks, result_path, cache_key, cache_meta, mimetype, download_name, headers):
+    """send_result arguments for a result streamed as it is written to result_path, cached once complete"""
+    def send_and_cache():
+        yield from chunks
+        # The complete file was written alongside the response; keep it for repeat requests
+        result_cache.put_file(cache_key, result_path, cache_meta)
+
+    return {
+        'content': send_and_cache(),
+        'meta': None,
+        'mimetype': mimetype,
+        'download_name': download_name,
+        'headers': headers
+    }
+
+
+def form_flag(name):
+    """True when a boolean form field is set (true/1/yes)"""
+    return request.form.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def wants_async():
+    """True when the client asked for the work to run as a background job (async=true)"""
+    return form_flag('async')
+
+
+def job_view(state):
+    """Public JSON view of a job's state"""
+    view = {
+        'id': state['id'],
+        'kind': state.get('kind'),
+        'status': state.get('status'),
+        'progress': state.get('progress'),
+        'status_url': f"/api/jobs/{state['id']}"
+    }
+    if state.get('status') == 'done':
+        view['result_url'] = f"/api/jobs/{state['id']}/result"
+    if state.get('error'):
+        view['error'] = state['error']
+    return view
+
+
+def submit_job(job_id, func, *args, **kwargs):
+    """Queue a job whose inputs are already in its directory and answer 202 with its status URL"""
+    jobs.submit(job_id, func, *args, **kwargs)
+    return jsonify({"success": True, "job": job_view(jobs.get(job_id))}), 202
+
+
+def dispatch_upload(kind, upload, func, make_args, respond=send_result, spool_name='upload.pdf', stream=False, job_func=None, **kwargs):
+    """Spool an upload and run func(*make_args(path, workdir), **kwargs) on it, as a job (job_func if given) when asked.
+
+    Synchronous calls answer with respond(**result) and also get stream=True when stream is set.
+    """
+    job_id = None
+    try:
+        if wants_async():
+            job_id, workdir = jobs.create(kind, session['user']['id'])
+        else:
+            workdir = make_request_workdir()
+        args = make_args(spool_upload(upload, workdir, spool_name), workdir)
+        if job_id:
+            return submit_job(job_id, job_func or func, *args, **kwargs)
+    except JobQueueFull:
+        return jsonify({"success": False, "message": "Too many jobs in progress. Please try again shortly."}), 503
+    except Exception:
+        if job_id:
+            jobs.discard(job_id)
+        raise
+
+    if stream:
+        kwargs['stream'] = True
+    return respond(**func(*args, **kwargs))
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    """Report a job's progress, or cancel it with DELETE"""
+    if 'user' not in session:
+        return jsonify({"success": False, "message": "Authentication required."}), 401
+
+    owner = session['user']['id']
+    state = jobs.cancel(job_id, owner) if request.method == 'DELETE' else jobs.get(job_id, owner)
+    if state is None:
+        return jsonify({"success": False, "message": "Job not found or expired."}), 404
+    return jsonify({"success": True, "job": job_view(state)})
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Serve the output of a finished job"""
+    if 'user' not in session:
+        return jsonify({"success": False, "message": "Authentication required."}), 401
+
+    state = jobs.get(job_id, session['user']['id'])
+    if state is None:
+        return jsonify({"success": False, "message": "Job not found or expired."}), 404
+
+    status = state.get('status')
+    if status == 'failed':
+        return jsonify({"success": False, "message": f"Job failed: {state.get('error')}", "job": job_view(state)}), 500
+    if status != 'done':
+        return jsonify({"success": False, "message": f"Job is {status}.", "job": job_view(state)}), 409
+
+    result = state['result']
+    if 'payload' in result:
+        return jsonify(result['payload']), result.get('status', 200)
+    return send_result(**result)
+
+
 @app.route('/api/compress-pdf', methods=['POST'])
 def compress_pdf():
     if 'user' not in session:
@@ -884,54 +1135,206 @@ def compress_pdf():
     if not pdf_file.filename.lower().endswith('.pdf'):
         return jsonify({"success": False, "message": "Invalid file type. Only PDF files are allowed."}), 400
 
+    # Optional target size (e.g. "2MB") replaces the fixed compression presets
+    target_size = None
+    if request.form.get('target_size'):
+        try:
+            target_size = parse_size(request.form['target_size'])
+        except ValueError:
+            return jsonify({"success": False, "message": "Invalid target size. Use a byte count or a value like '2MB'."}), 400
+
     original_filename = pdf_file.filename
+    protect = bool(password and password.strip())
+    # Linearized ("fast web view") output lets viewers show page 1 before the download finishes
+    linearize = form_flag('linearize')
     
     try:
-        # Read the original file content
-        pdf_content = pdf_file.read()
-        original_size = len(pdf_content)
-        
+        # Spool the upload to disk; the PDF engines open it by path
+        args = lambda input_path, workdir: (input_path, workdir, original_filename, compression_level, target_size, password if protect else None, linearize)
+        return dispatch_upload('compress-pdf', pdf_file, run_compress_pdf, args)
+
+    except Exception as e:
+        print(f"Error during PDF compression: {e}")
+        return jsonify({"success": False, "message": f"Compression failed: {str(e)}"}), 500
+
+
+def run_compress_pdf(input_path, workdir, original_filename, compression_level='high', target_size=None, password=None, linearize=False, progress=None):
+    """Compress a spooled PDF (or fetch it from the result cache); returns the send_result arguments"""
+    original_size = os.path.getsize(input_path)
+    
+    # Repeat uploads with the same settings are served from the result cache.
+    # Password-protected output is never cached.
+    cache_key = None
+    if not password:
+        if target_size:
+            params = {'target_size': target_size}
+        else:
+            level = compression_level if compression_level in ('extreme', 'high', 'medium') else 'low'
+            params = {'compression_level': level}
+        if linearize:
+            params['linearize'] = True
+        cache_key = result_cache_key('compress-pdf', [hash_file(input_path)], params)
+    cached_path, meta = result_cache.get(cache_key)
+    
+    if cached_path:
+        print(f"Serving cached compression of {original_filename}")
+        result = cached_path
+        compressed_size = os.path.getsize(cached_path)
+        steps = meta.get('steps', 0)
+    else:
         print(f"Starting compression of {original_filename} ({original_size} bytes)")
         
-        # Compress the PDF
-        compressed_content = compress_pdf_advanced(pdf_content, compression_level)
-        compressed_size = len(compressed_content)
+        # Compress the PDF, adding password protection in the same save if requested
+        output_path = os.path.join(workdir, 'compressed.pdf')
+        if target_size:
+            result, steps = compress_pdf_to_target(input_path, output_path, target_size, password=password, progress=progress, linearize=linearize)
+        else:
+            steps = 1
+            result = compress_pdf_advanced(input_path, output_path, compression_level, password=password, progress=progress, linearize=linearize)
+        compressed_size = os.path.getsize(result)
         
         print(f"Compression result: {original_size} -> {compressed_size} bytes")
         
-        # Add password protection if requested
-        if password and password.strip():
-            compressed_content = add_password_protection(compressed_content, password)
-            compressed_size = len(compressed_content)
-        
-        # Create response
-        compressed_filename = f"compressed_{original_filename}"
-        
-        response = make_response(send_file(
-            io.BytesIO(compressed_content),
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=compressed_filename
-        ))
-        
-        # Add custom headers
-        response.headers['X-Original-Size'] = str(original_size)
-        response.headers['X-Compressed-Size'] = str(compressed_size)
-        response.headers['X-Compressed-Filename'] = compressed_filename
-        response.headers['Access-Control-Expose-Headers'] = 'X-Original-Size, X-Compressed-Size, X-Compressed-Filename'
-        
-        return response
+        cached_path, meta = result_cache.put_file(cache_key, result, {'steps': steps})
+        result = cached_path or result
+    
+    compressed_filename = f"compressed_{original_filename}"
+    headers = {
+        'X-Original-Size': str(original_size),
+        'X-Compressed-Size': str(compressed_size),
+        'X-Compressed-Filename': compressed_filename
+    }
+    if target_size:
+        headers['X-Compressed-Target-Size'] = str(target_size)
+        headers['X-Compressed-Target-Met'] = 'true' if compressed_size <= target_size else 'false'
+        headers['X-Compressed-Steps'] = str(steps)
+    
+    return {
+        'content': result,
+        'meta': meta,
+        'mimetype': 'application/pdf',
+        'download_name': compressed_filename,
+        'headers': headers
+    }
 
-    except Exception as e:
-        print(f"Error during PDF compression: {e}")
-        return jsonify({"success": False, "message": f"Compression failed: {str(e)}"}), 500
 
+def parse_size(value):
+    """Parse a size such as '2MB', '500 KB' or '150000' into bytes"""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?\s*", value, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    multiplier = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[match.group(2).upper()]
+    size = int(float(match.group(1)) * multiplier)
+    if size <= 0:
+        raise ValueError(f"Invalid size: {value}")
+    return size
+
+
+# --- PDF Compression Settings ---
+# Number of worker processes used to recompress embedded images (1 = serial)
+PDF_COMPRESS_WORKERS = int(os.environ.get('PDF_COMPRESS_WORKERS', os.cpu_count() or 1))
+# Documents with fewer images than this are recompressed serially; the pool start-up would cost more
+PDF_COMPRESS_MIN_POOL_IMAGES = int(os.environ.get('PDF_COMPRESS_MIN_POOL_IMAGES', 4))
+
+# (JPEG quality, max image size) steps searched by target-size compression, gentlest first
+TARGET_SIZE_LADDER = [
+    (85, (2000, 2500)),
+    (70, (1600, 2000)),
+    (60, (1400, 1750)),
+    (50, (1200, 1500)),
+    (40, (1000, 1250)),
+    (30, (800, 1000)),
+    (25, (640, 800)),
+    (20, (480, 600)),
+]
+# Upper bound on encode passes per target-size request
+PDF_TARGET_MAX_STEPS = max(1, int(os.environ.get('PDF_TARGET_MAX_STEPS', 6)))
+# Share of the file that must be image data before the image recompression pass is worth running
+PDF_ROUTE_MIN_IMAGE_SHARE = float(os.environ.get('PDF_ROUTE_MIN_IMAGE_SHARE', 0.1))
+# Image-free documents with this many objects are rewritten by pikepdf instead of fitz
+PDF_ROUTE_PIKEPDF_MIN_OBJECTS = int(os.environ.get('PDF_ROUTE_PIKEPDF_MIN_OBJECTS', 20000))
+# Below this share of font bytes the structural rewrite skips merging duplicate objects
+PDF_ROUTE_DEDUPE_MIN_FONT_SHARE = float(os.environ.get('PDF_ROUTE_DEDUPE_MIN_FONT_SHARE', 0.1))
+# Documents with at least this many pages (or larger than the memory budget) are compressed
+# in page windows flushed to disk, keeping memory within PDF_STREAM_MEMORY_MB
+PDF_STREAM_MIN_PAGES = int(os.environ.get('PDF_STREAM_MIN_PAGES', 300))
+PDF_STREAM_MEMORY_MB = int(os.environ.get('PDF_STREAM_MEMORY_MB', 256))
+PDF_STREAM_WINDOW_PAGES = max(1, int(os.environ.get('PDF_STREAM_WINDOW_PAGES', 50)))
+# Memory allowed for decoded images kept between target-size steps
+PDF_TARGET_DECODE_CACHE_MB = int(os.environ.get('PDF_TARGET_DECODE_CACHE_MB', 256))
+
+# Images whose stream is smaller than this are left alone
+MIN_RECOMPRESS_BYTES = 5000
+# Floor on the size of a re-encoded JPEG (header + flat-content bytes per pixel);
+# images already stored in less than this can't shrink
+JPEG_MIN_HEADER_BYTES = 600
+JPEG_MIN_BYTES_PER_PIXEL = 0.006
+# Standard JPEG luminance quantization table (IJG quality 50)
+JPEG_STD_LUMINANCE_TABLE = [
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+]
+
+
+# --- PDF Rendering Settings ---
+# Process pool used to rasterize pages (PDF to images); 1 renders serially
+PDF_RASTER_WORKERS = int(os.environ.get('PDF_RASTER_WORKERS', os.cpu_count() or 1))
+# Below this much output (pages x rendered megapixels) the pool start-up costs more than it saves
+PDF_RASTER_MIN_POOL_MEGAPIXELS = float(os.environ.get('PDF_RASTER_MIN_POOL_MEGAPIXELS', 40))
+# zlib level for rendered PNGs; on rendered pages 3 is faster and no bigger than the default 6
+PNG_COMPRESS_LEVEL = int(os.environ.get('PNG_COMPRESS_LEVEL', 3))
+# Rough cost of decoding a cached PNG page, to compare against re-rendering it
+PNG_DECODE_SECONDS_PER_MEGAPIXEL = 0.01
+# PDF to Word page images: pixel density at the 6-inch width they are shown at,
+# and the JPEG quality for pages that are mostly images (others become palette PNGs)
+WORD_IMAGE_PPI = int(os.environ.get('WORD_IMAGE_PPI', 200))
+WORD_JPEG_QUALITY = int(os.environ.get('WORD_JPEG_QUALITY', 85))
+WORD_JPEG_MIN_IMAGE_SHARE = float(os.environ.get('WORD_JPEG_MIN_IMAGE_SHARE', 0.25))
+# Resolutions the endpoints render at; derived resolutions round up to these to share the page cache
+STANDARD_RENDER_DPIS = (72, 150, 300)
+# Page previews: default and largest resolution clients can ask for
+THUMBNAIL_DPI = int(os.environ.get('THUMBNAIL_DPI', 36))
+THUMBNAIL_MAX_DPI = int(os.environ.get('THUMBNAIL_MAX_DPI', 96))
+
+# --- Images to PDF Settings ---
+# Threads preparing (decoding and re-encoding) uploaded images for the PDF; 1 prepares them serially
+IMAGES_TO_PDF_WORKERS = int(os.environ.get('IMAGES_TO_PDF_WORKERS', os.cpu_count() or 1))
+
+
+def ordered_map(func, items, executor=None, window=8):
+    """Apply func to items (on executor if given), yielding (item, result) in input order"""
+    if executor is None:
+        for item in items:
+            yield item, func(item)
+        return
+
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(func, item)))
+        # Keep a limited number of tasks in flight so results don't pile up in memory
+        if len(pending) >= window:
+            done_item, future = pending.popleft()
+            yield done_item, future.result()
+    while pending:
+        done_item, future = pending.popleft()
+        yield done_item, future.result()
+
+
+def compress_pdf_advanced(input_path, output_path, compression_level, workers=None, password=None, progress=None, linearize=False):
+    """Advanced PDF compression using PyMuPDF with proper error handling; returns the path of the result"""
+    if workers is None:
+        workers = PDF_COMPRESS_WORKERS
 
-def compress_pdf_advanced(pdf_content, compression_level):
-    """Advanced PDF compression using PyMuPDF with proper error handling"""
     try:
-        # Open PDF from memory
-        doc = fitz.open("pdf", pdf_content)
+        # Open PDF from disk
+        doc = fitz.open(input_path)
+        page_count = len(doc)
         
         # Set compression parameters based on level
         if compression_level == 'extreme':
@@ -955,29 +1358,112 @@ def compress_pdf_advanced(pdf_content, compression_level):
             remove_annotations = False
             remove_links = False
         
-        print(f"Processing {len(doc)} pages with {compression_level} compression")
-        
-        # Process each page
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            
-            # Remove annotations if requested
-            if remove_annotations:
-                try:
-                    while page.first_annot:
-                        page.delete_annot(page.first_annot)
-                except:
-                    pass
-            
-            # Remove links if requested
-            if remove_links:
+        # Survey the document before doing any work and skip engines that can't help
+        analysis = analyze_pdf(doc, input_path)
+        route = route_compression(analysis)
+        print(
+            f"PDF analysis: {analysis['image_count']} images ({analysis['image_share']:.0%} of bytes), "
+            f"fonts {analysis['font_share']:.0%}, "
+            f"damaged: {analysis['damaged']} -> {route} path"
+        )
+        if route == 'pikepdf':
+            doc.close()
+            return compress_pdf_fallback(input_path, output_path, compression_level, password, linearize)
+        if route == 'structural':
+            # Nothing worth recompressing: page clean-up and a compacting save only
+            for page in doc:
+                clean_page(page, remove_annotations, remove_links)
+            if compression_level == 'extreme':
                 try:
-                    page.delete_link(page.first_link)
+                    doc.set_metadata({})
                 except:
                     pass
-            
-            # Compress images on the page
-            compress_page_images(page, image_quality, max_image_size)
+            # Without images or much font data there is next to nothing to deduplicate, and
+            # leaving out the duplicate-object search (garbage=2) halves the save
+            garbage = 4 if analysis['font_share'] >= PDF_ROUTE_DEDUPE_MIN_FONT_SHARE else 2
+            save_pdf_output(doc, output_path, password, linearize, garbage=garbage)
+            if progress:
+                progress(page_count, page_count)
+            doc.close()
+            print(f"Structural compression: {os.path.getsize(input_path)} -> {os.path.getsize(output_path)} bytes")
+            return output_path
+        
+        # Very large documents are streamed: pages are handled in windows, and after each
+        # window the replaced images are flushed to an on-disk working copy with an
+        # incremental save and the document is reopened, so memory stays within a budget
+        streaming = page_count >= PDF_STREAM_MIN_PAGES or os.path.getsize(input_path) > PDF_STREAM_MEMORY_MB * 1024 * 1024
+        working_path = output_path + '.working'
+        if streaming:
+            if doc.is_repaired:
+                # Incremental saves can't be appended to a damaged file, so write a clean copy
+                doc.save(working_path)
+            else:
+                shutil.copyfile(input_path, working_path)
+            doc.close()
+            doc = fitz.open(working_path)
+        
+        # No more workers than there are images, and none at all for a handful
+        if analysis['image_count'] < PDF_COMPRESS_MIN_POOL_IMAGES:
+            workers = 1
+        workers = max(1, min(workers, analysis['image_count']))
+        
+        print(f"Processing {page_count} pages with {compression_level} compression ({workers} workers{', streaming' if streaming else ''})")
+        
+        # Extract and recompress images on the worker pool, applying the results in document order
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_image_worker,
+                initargs=(input_path,)
+            )
+            recompress = partial(_recompress_worker_image, quality=image_quality, max_size=max_image_size, release=streaming)
+        
+        # Duplicate-image bookkeeping shared by every window
+        image_registry = {}
+        next_page = 0
+        pending_bytes = 0
+        
+        def window_pages():
+            # End the window after PDF_STREAM_WINDOW_PAGES pages or once enough replaced
+            # image data is waiting to be flushed
+            nonlocal next_page
+            first_page = next_page
+            while next_page < page_count:
+                if streaming and (next_page - first_page >= PDF_STREAM_WINDOW_PAGES or pending_bytes >= PDF_STREAM_MEMORY_MB * 1024 * 1024 // 4):
+                    return
+                next_page += 1
+                yield next_page - 1
+        
+        try:
+            while next_page < page_count:
+                pending_bytes = 0
+                if executor is None:
+                    recompress = partial(recompress_xref, doc, quality=image_quality, max_size=max_image_size, release=streaming)
+                
+                # Walk this window's pages and collect their images for recompression
+                image_xrefs = iter_page_images(doc, remove_annotations, remove_links, progress, window_pages(), image_registry)
+                
+                for xref, result in ordered_map(recompress, image_xrefs, executor, window=workers * 2):
+                    if result is None:
+                        continue
+                    compressed_image_bytes, width, height = result
+                    try:
+                        replace_image_stream(doc, xref, compressed_image_bytes, width, height)
+                        pending_bytes += len(compressed_image_bytes)
+                    except Exception as e:
+                        print(f"Could not replace image xref {xref}: {e}")
+                
+                if streaming and next_page < page_count:
+                    # Flush the window and drop everything MuPDF has cached for it
+                    doc.save(working_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+                    doc.close()
+                    fitz.TOOLS.store_shrink(100)
+                    doc = fitz.open(working_path)
+                    print(f"Flushed pages up to {next_page} of {page_count}")
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
         
         # Remove metadata for extreme compression
         if compression_level == 'extreme':
@@ -986,142 +1472,546 @@ def compress_pdf_advanced(pdf_content, compression_level):
             except:
                 pass
         
-        # Save to memory with compression options
-        output_buffer = io.BytesIO()
-        
-        # Use tobytes() method which is more reliable
-        compressed_pdf = doc.tobytes(
-            garbage=4,  # Remove unused objects
-            deflate=True,  # Compress content streams
-            clean=True,  # Clean up the file structure
-            ascii=False,  # Use binary encoding
-            expand=0,  # Don't expand content streams
-            linear=False,  # Don't linearize
-            pretty=False  # Don't pretty-print
-        )
+        # Clean up, compress and (optionally) encrypt and linearize in a single output stage
+        save_pdf_output(doc, output_path, password, linearize)
         
+        if progress:
+            progress(page_count, page_count)
         doc.close()
+        if streaming:
+            os.remove(working_path)
         
-        print(f"PyMuPDF compression successful: {len(pdf_content)} -> {len(compressed_pdf)} bytes")
-        return compressed_pdf
+        print(f"PyMuPDF compression successful: {os.path.getsize(input_path)} -> {os.path.getsize(output_path)} bytes")
+        return output_path
         
     except Exception as e:
         print(f"PyMuPDF compression failed: {e}")
+        if os.path.exists(output_path + '.working'):
+            os.remove(output_path + '.working')
         # Fallback to pikepdf compression
-        return compress_pdf_fallback(pdf_content, compression_level)
+        return compress_pdf_fallback(input_path, output_path, compression_level, password, linearize)
+
 
+def compress_pdf_to_target(input_path, output_path, target_size, workers=None, password=None, progress=None, linearize=False):
+    """Search image quality/size until the PDF fits target_size; returns (result_path, steps)"""
+    if workers is None:
+        workers = PDF_COMPRESS_WORKERS
 
-def compress_page_images(page, quality, max_size):
-    """Compress images on a PDF page"""
     try:
-        # Get all images on the page
-        image_list = page.get_images(full=True)
-        
-        for img_index, img in enumerate(image_list):
-            try:
-                # Get image reference
-                xref = img[0]
-                
-                # Extract image
-                base_image = page.parent.extract_image(xref)
-                image_bytes = base_image["image"]
-                image_ext = base_image["ext"]
-                
-                # Skip very small images
-                if len(image_bytes) < 5000:  # Less than 5KB
-                    continue
-                
-                print(f"Processing image {img_index}: {len(image_bytes)} bytes, format: {image_ext}")
-                
-                # Open image with PIL
+        # Images are extracted from this copy. It is never saved, because a garbage-collecting
+        # save renumbers xrefs and would invalidate the encodings kept between steps.
+        doc = fitz.open(input_path)
+        image_xrefs = list(iter_page_images(doc, progress=progress))
+        original_image_sizes = {xref: len(doc.xref_stream_raw(xref)) for xref in image_xrefs}
+        print(f"Target-size compression of {len(doc)} pages to {target_size} bytes ({len(image_xrefs)} images)")
+
+        def write_output(encodings):
+            # Apply a step's images to a fresh copy of the document and save it
+            output_doc = fitz.open(input_path)
+            for _ in iter_page_images(output_doc):  # same duplicate sharing as the source copy
+                pass
+            for xref, (jpeg_bytes, width, height) in encodings.items():
+                replace_image_stream(output_doc, xref, jpeg_bytes, width, height)
+            save_pdf_output(output_doc, output_path, password, linearize)
+            output_doc.close()
+            return os.path.getsize(output_path)
+
+        # Size of everything that isn't a candidate image: save once with 1x1 placeholders
+        placeholder = encode_jpeg(Image.new('RGB', (1, 1), (255, 255, 255)), 50)
+        overhead = write_output({xref: (placeholder, 1, 1) for xref in image_xrefs}) - len(placeholder) * len(image_xrefs)
+
+        # Decoded images are kept between steps (within a memory budget) so each is extracted once
+        decoded_images = {}
+        decode_budget = PDF_TARGET_DECODE_CACHE_MB * 1024 * 1024
+        largest_size = TARGET_SIZE_LADDER[0][1]
+
+        def load_image(xref):
+            nonlocal decode_budget
+            if xref in decoded_images:
+                return decoded_images[xref]
+            # Images that can't shrink even at the most aggressive step are never decoded
+            reason = prescreen_image(doc, xref, *TARGET_SIZE_LADDER[-1])
+            if reason:
+                print(f"Skipping image xref {xref}: {reason}")
+                decoded_images[xref] = None
+                return None
+            image_bytes = doc.extract_image(xref)["image"]
+            if len(image_bytes) < MIN_RECOMPRESS_BYTES:  # Skip very small images
+                decoded_images[xref] = None
+                return None
+            # Every step is at most the first step's size, so that is all that needs keeping
+            image = prepare_image(open_image(image_bytes, largest_size), largest_size)
+            footprint = image.size[0] * image.size[1] * 3
+            if footprint <= decode_budget:
+                decoded_images[xref] = image
+                decode_budget -= footprint
+            return image
+
+        step_results = {}
+        # Images that can be re-encoded at all, as found by the first step
+        candidate_count = None
+
+        def encode_step(step):
+            nonlocal candidate_count
+            if step in step_results:
+                return step_results[step]
+            quality, max_size = TARGET_SIZE_LADDER[step]
+            # fitz isn't thread-safe, so decoding happens here and only resize/encode is threaded
+            images = []
+            for xref in image_xrefs:
                 try:
-                    image = Image.open(io.BytesIO(image_bytes))
+                    image = load_image(xref)
                 except Exception as e:
-                    print(f"Could not open image {img_index}: {e}")
+                    print(f"Could not decode image xref {xref}: {e}")
+                    decoded_images[xref] = image = None
+                if image is not None:
+                    images.append((xref, image))
+            candidate_count = len(images)
+
+            def encode(job):
+                image = prepare_image(job[1], max_size)
+                return encode_jpeg(image, quality), image.size
+
+            encodings = {}
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+                for (xref, _), (jpeg_bytes, (width, height)) in ordered_map(encode, images, executor, window=max(workers, 1) * 2):
+                    # Keep the original where re-encoding doesn't help
+                    if len(jpeg_bytes) < original_image_sizes[xref]:
+                        encodings[xref] = (jpeg_bytes, width, height)
+            predicted = overhead + sum(
+                len(encodings[xref][0]) if xref in encodings else size
+                for xref, size in original_image_sizes.items()
+            )
+            print(f"Step {step} (quality {quality}, max {max_size}): predicted {predicted} bytes")
+            step_results[step] = (encodings, predicted)
+            return encodings, predicted
+
+        # Binary search the ladder for the gentlest step whose predicted size fits
+        steps = 0
+        low, high = 0, len(TARGET_SIZE_LADDER) - 1
+        chosen = None  # (step, encodings)
+        most_aggressive = None
+        while low <= high and steps < PDF_TARGET_MAX_STEPS:
+            step = (low + high) // 2
+            encodings, predicted = encode_step(step)
+            steps += 1
+            if progress:
+                # Past the page scan, progress is counted in encode passes
+                progress(steps, PDF_TARGET_MAX_STEPS)
+            if not candidate_count:
+                # No image can be re-encoded, so every step would give the same result
+                chosen = (step, encodings)
+                break
+            if predicted <= target_size:
+                chosen = (step, encodings)
+                high = step - 1
+            else:
+                if most_aggressive is None or step > most_aggressive[0]:
+                    most_aggressive = (step, encodings)
+                low = step + 1
+
+        if chosen is None:
+            chosen = most_aggressive
+
+        # Apply the chosen step and verify the real size, stepping down while budget remains
+        while True:
+            step, encodings = chosen
+            achieved = write_output(encodings)
+            print(f"Target-size step {step}: {achieved} bytes (target {target_size})")
+
+            if achieved <= target_size or step >= len(TARGET_SIZE_LADDER) - 1 or not candidate_count:
+                break
+            if step + 1 not in step_results:
+                if steps >= PDF_TARGET_MAX_STEPS:
+                    break
+                steps += 1
+            encodings, _ = encode_step(step + 1)
+            chosen = (step + 1, encodings)
+
+        if progress:
+            progress(PDF_TARGET_MAX_STEPS, PDF_TARGET_MAX_STEPS)
+        doc.close()
+        return output_path, steps
+
+    except Exception as e:
+        print(f"Target-size compression failed: {e}")
+        # Fallback to pikepdf compression
+        return compress_pdf_fallback(input_path, output_path, 'high', password, linearize), 0
+
+
+def iter_page_images(doc, remove_annotations=False, remove_links=False, progress=None, pages=None, registry=None):
+    """Clean up each page (or just pages) and yield the xref of every distinct image, sharing duplicates through registry"""
+    if registry is None:
+        registry = {}
+    # Document-level image registry: content hash -> canonical xref
+    image_registry = registry.setdefault('images', {})
+    # Duplicate xref -> the canonical xref its references now point at
+    duplicate_xrefs = registry.setdefault('duplicates', {})
+    seen_xrefs = registry.setdefault('seen', set())
+
+    for page_number in (range(len(doc)) if pages is None else pages):
+        page = doc.load_page(page_number)
+        if progress:
+            progress(page.number, len(doc))
+
+        clean_page(page, remove_annotations, remove_links)
+
+        try:
+            # Get all images on the page
+            image_list = page.get_images(full=True)
+        except Exception as e:
+            print(f"Page image compression error: {e}")
+            continue
+
+        for img in image_list:
+            xref, name, referencer = img[0], img[7], img[9]
+            # The resources holding the image belong to a form XObject or to the page itself
+            owner = referencer or page.xref
+
+            if xref in duplicate_xrefs:
+                # Point this use at the shared copy as well
+                if repoint_image_reference(doc, owner, name, duplicate_xrefs[xref]):
                     continue
-                
-                # Get original dimensions
-                width, height = image.size
-                max_width, max_height = max_size
-                
-                # Resize if too large
-                if width > max_width or height > max_height:
-                    # Calculate resize ratio
-                    ratio = min(max_width / width, max_height / height)
-                    new_width = int(width * ratio)
-                    new_height = int(height * ratio)
-                    
-                    print(f"Resizing image from {width}x{height} to {new_width}x{new_height}")
-                    image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                
-                # Convert to RGB if necessary
-                if image.mode in ('RGBA', 'LA', 'P'):
-                    # Create white background
-                    background = Image.new('RGB', image.size, (255, 255, 255))
-                    if image.mode == 'P':
-                        image = image.convert('RGBA')
-                    if image.mode in ('RGBA', 'LA'):
-                        background.paste(image, mask=image.split()[-1])
-                    else:
-                        background.paste(image)
-                    image = background
-                elif image.mode != 'RGB':
-                    image = image.convert('RGB')
-                
-                # Compress image to JPEG
-                compressed_image_buffer = io.BytesIO()
-                image.save(
-                    compressed_image_buffer, 
-                    format='JPEG', 
-                    quality=quality, 
-                    optimize=True,
-                    progressive=True
-                )
-                compressed_image_bytes = compressed_image_buffer.getvalue()
-                
-                # Only replace if compression was effective
-                if len(compressed_image_bytes) < len(image_bytes):
-                    print(f"Image compressed: {len(image_bytes)} -> {len(compressed_image_bytes)} bytes")
-                    
-                    # Replace image in PDF
-                    try:
-                        # Create new image object
-                        img_dict = {
-                            "width": image.size[0],
-                            "height": image.size[1],
-                            "colorspace": 3,  # RGB
-                            "bpc": 8,  # 8 bits per component
-                            "filter": "DCTDecode",  # JPEG compression
-                            "image": compressed_image_bytes
-                        }
-                        
-                        # Update the image
-                        page.parent.update_stream(xref, compressed_image_bytes)
-                        
-                    except Exception as e:
-                        print(f"Could not replace image {img_index}: {e}")
-                else:
-                    print(f"Image {img_index}: compression not effective, keeping original")
-                
+                # The reference could not be rewritten, so the duplicate needs its own pass
+                del duplicate_xrefs[xref]
+                yield xref
+                continue
+
+            # Images shared between pages only need to be handled once
+            if xref in seen_xrefs:
+                continue
+            seen_xrefs.add(xref)
+
+            # Byte-identical images stored under different xrefs are encoded once and shared
+            try:
+                canonical = image_registry.setdefault(image_content_key(doc, xref), xref)
             except Exception as e:
-                print(f"Error processing image {img_index}: {e}")
+                print(f"Could not hash image xref {xref}: {e}")
+                canonical = xref
+
+            if canonical != xref and repoint_image_reference(doc, owner, name, canonical):
+                print(f"Image xref {xref} duplicates xref {canonical}, sharing one copy")
+                duplicate_xrefs[xref] = canonical
                 continue
-                
+
+            yield xref
+
+
+def clean_page(page, remove_annotations=False, remove_links=False):
+    """Strip annotations and/or links from a page"""
+    # Remove annotations if requested
+    if remove_annotations:
+        try:
+            while page.first_annot:
+                page.delete_annot(page.first_annot)
+        except:
+            pass
+    
+    # Remove links if requested
+    if remove_links:
+        try:
+            page.delete_link(page.first_link)
+        except:
+            pass
+
+
+def analyze_pdf(doc, input_path):
+    """Survey a PDF from its xref table and object dictionaries, without decoding or rendering anything"""
+    file_bytes = max(os.path.getsize(input_path), 1)
+    image_bytes = 0
+    image_count = 0
+    font_files = set()
+
+    for xref in range(1, doc.xref_length()):
+        try:
+            object_type = doc.xref_get_key(xref, "Type")[1]
+            if object_type == '/FontDescriptor':
+                # Embedded font programs hang off the descriptor
+                for key in ('FontFile', 'FontFile2', 'FontFile3'):
+                    kind, value = doc.xref_get_key(xref, key)
+                    if kind == 'xref':
+                        font_files.add(int(value.split()[0]))
+                continue
+            if doc.xref_get_key(xref, "Subtype")[1] == '/Image' and doc.xref_is_stream(xref):
+                image_bytes += stream_length(doc, xref)
+                image_count += 1
+        except Exception as e:
+            print(f"Could not analyze xref {xref}: {e}")
+
+    font_bytes = sum(stream_length(doc, xref) for xref in font_files)
+    return {
+        'pages': len(doc),
+        'file_bytes': file_bytes,
+        'image_count': image_count,
+        'image_bytes': image_bytes,
+        'image_share': image_bytes / file_bytes,
+        'font_bytes': font_bytes,
+        'font_share': font_bytes / file_bytes,
+        'object_count': doc.xref_length() - 1,
+        'damaged': doc.is_repaired
+    }
+
+
+def stream_length(doc, xref):
+    """A stream's stored length from its dictionary, following an indirect /Length"""
+    try:
+        kind, value = doc.xref_get_key(xref, "Length")
+        if kind == 'xref':
+            value = doc.xref_object(int(value.split()[0]), compressed=True)
+        return int(value)
+    except (ValueError, RuntimeError):
+        return 0
+
+
+def route_compression(analysis):
+    """Pick the cheapest compression path that can still help: 'images', 'structural' or 'pikepdf'"""
+    # Only documents with a meaningful share of image bytes gain from the image pass
+    if analysis['image_count'] and analysis['image_share'] >= PDF_ROUTE_MIN_IMAGE_SHARE:
+        return 'images'
+    # MuPDF's compacting save grows faster than linearly with the object count, while
+    # qpdf stays linear; past a point the pikepdf rewrite is the only affordable one
+    if analysis['object_count'] >= PDF_ROUTE_PIKEPDF_MIN_OBJECTS:
+        return 'pikepdf'
+    # Text, vector and font-heavy documents only gain from a compacting rewrite
+    # (garbage collection, deflate and object streams)
+    return 'structural'
+
+
+def image_content_key(doc, xref, depth=3):
+    """Hash an object's definition and raw stream, following indirect references a few levels deep"""
+    source = doc.xref_object(xref, compressed=True)
+    if depth > 0:
+        # Referenced objects (colorspaces, ICC profiles, soft masks) are compared by content too
+        source = re.sub(
+            r"(\d+) \d+ R",
+            lambda match: image_content_key(doc, int(match.group(1)), depth - 1),
+            source
+        )
+    digest = hashlib.sha256(source.encode())
+    if doc.xref_is_stream(xref):
+        digest.update(doc.xref_stream_raw(xref))
+    return digest.hexdigest()
+
+
+def repoint_image_reference(doc, owner, name, xref):
+    """Make the /XObject resource `name` of owner point at xref; returns False if it can't be found"""
+    path = []
+    for key in ("Resources", "XObject"):
+        kind, value = doc.xref_get_key(owner, "/".join(path + [key]))
+        if kind == "xref":
+            # Follow indirect dictionaries; xref_set_key can't write through them
+            owner = int(value.split()[0])
+            path = []
+        elif kind == "dict":
+            path.append(key)
+        else:
+            # Inherited or missing resources
+            return False
+    doc.xref_set_key(owner, "/".join(path + [name]), f"{xref} 0 R")
+    return True
+
+
+_image_worker_doc = None
+
+
+def _init_image_worker(pdf_path):
+    """Open a private copy of the document in each image worker process"""
+    global _image_worker_doc
+    _image_worker_doc = fitz.open(pdf_path)
+
+
+def _recompress_worker_image(xref, quality, max_size, release=False):
+    """Pool entry point: recompress one image from the worker's own copy of the document"""
+    return recompress_xref(_image_worker_doc, xref, quality, max_size, release)
+
+
+def recompress_xref(doc, xref, quality, max_size, release=False):
+    """Extract the image stored at xref and recompress it, returning (jpeg_bytes, width, height) or None"""
+    # Rule out images that can't shrink from their metadata alone, before decoding anything
+    reason = prescreen_image(doc, xref, quality, max_size)
+    if reason:
+        print(f"Skipping image xref {xref}: {reason}")
+        return None
+
+    try:
+        base_image = doc.extract_image(xref)
     except Exception as e:
-        print(f"Page image compression error: {e}")
-        pass
+        print(f"Error extracting image xref {xref}: {e}")
+        return None
+    finally:
+        # Keep MuPDF's store (up to 256 MB) from filling with decoded images that won't be needed again
+        if release:
+            fitz.TOOLS.store_shrink(100)
+    image_bytes = base_image["image"]
+
+    # Skip very small images
+    if len(image_bytes) < MIN_RECOMPRESS_BYTES:
+        return None
+
+    print(f"Processing image xref {xref}: {len(image_bytes)} bytes, format: {base_image['ext']}")
+    result = recompress_image(image_bytes, quality, max_size)
+    if result is not None:
+        print(f"Image xref {xref} compressed: {len(image_bytes)} -> {len(result[0])} bytes")
+    return result
+
+
+def prescreen_image(doc, xref, quality, max_size):
+    """From an image's dictionary and raw stream size, the reason recompressing it can't help (None if worth decoding)"""
+    try:
+        raw_size = len(doc.xref_stream_raw(xref) or b'')
+        filter_type, filters = doc.xref_get_key(xref, "Filter")
+        width = int(doc.xref_get_key(xref, "Width")[1])
+        height = int(doc.xref_get_key(xref, "Height")[1])
+        bits = doc.xref_get_key(xref, "BitsPerComponent")[1]
+        image_mask = doc.xref_get_key(xref, "ImageMask")[1]
+    except Exception as e:
+        print(f"Could not read image xref {xref} metadata: {e}")
+        return None
+
+    if raw_size < MIN_RECOMPRESS_BYTES:
+        return "too small"
+
+    # 1-bit images (masks, CCITT/JBIG2 scans) are far smaller than any JPEG of them
+    if image_mask == 'true' or bits == '1' or 'CCITTFaxDecode' in filters or 'JBIG2Decode' in filters:
+        return "bilevel image"
+
+    # Pixel count after downscaling to max_size
+    max_width, max_height = max_size
+    ratio = min(1, max_width / width, max_height / height)
+    output_pixels = int(width * ratio) * int(height * ratio)
+
+    if raw_size <= JPEG_MIN_HEADER_BYTES + JPEG_MIN_BYTES_PER_PIXEL * output_pixels:
+        return f"already compact ({raw_size / (width * height):.3f} bytes/pixel)"
 
+    # A JPEG that doesn't need downscaling only shrinks when re-encoded at a lower quality
+    if ratio == 1 and filter_type == 'name' and filters == '/DCTDecode':
+        source_quality = estimate_jpeg_quality(doc.xref_stream_raw(xref))
+        if source_quality is not None and source_quality <= quality:
+            return f"already JPEG at quality {source_quality}"
 
-def compress_pdf_fallback(pdf_content, compression_level):
-    """Fallback compression using pikepdf only"""
+    return None
+
+
+def estimate_jpeg_quality(jpeg_bytes):
+    """Estimate the IJG quality a JPEG was saved at from its quantization tables, or None"""
     try:
-        print("Using pikepdf fallback compression")
+        # Opening only parses the headers; nothing is decoded
+        tables = Image.open(io.BytesIO(jpeg_bytes)).quantization
+    except Exception:
+        return None
+    if not tables or 0 not in tables:
+        return None
+
+    scale = sum(tables[0]) * 100 / sum(JPEG_STD_LUMINANCE_TABLE)
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return max(1, min(100, round(quality)))
+
+
+def open_image(image_bytes, max_size):
+    """Open image bytes with PIL, decoding JPEGs at a reduced scale when they will be downscaled anyway"""
+    image = Image.open(io.BytesIO(image_bytes))
+    width, height = image.size
+    max_width, max_height = max_size
+    if image.format == 'JPEG' and (width > max_width or height > max_height):
+        ratio = min(max_width / width, max_height / height)
+        # Draft mode picks the largest 1/2, 1/4 or 1/8 scale that still covers the requested size
+        image.draft(image.mode, (int(width * ratio), int(height * ratio)))
+    return image
+
+
+def recompress_image(image_bytes, quality, max_size):
+    """Re-encode an image as JPEG, returning (jpeg_bytes, width, height) or None if it doesn't shrink"""
+    try:
+        # Open image with PIL
+        try:
+            image = open_image(image_bytes, max_size)
+        except Exception as e:
+            print(f"Could not open image: {e}")
+            return None
         
-        # Open PDF from memory
-        input_stream = io.BytesIO(pdf_content)
-        output_stream = io.BytesIO()
+        # Get original dimensions
+        width, height = image.size
+        
+        image = prepare_image(image, max_size)
+        compressed_image_bytes = encode_jpeg(image, quality)
+        
+        # Only replace if compression was effective
+        if len(compressed_image_bytes) >= len(image_bytes):
+            print(f"Image {width}x{height}: compression not effective, keeping original")
+            return None
+
+        return compressed_image_bytes, image.size[0], image.size[1]
+
+    except Exception as e:
+        print(f"Error processing image: {e}")
+        return None
+
+
+def prepare_image(image, max_size):
+    """Downscale a PIL image to fit within max_size and flatten it to RGB"""
+    width, height = image.size
+    max_width, max_height = max_size
+    
+    # Resize if too large
+    if width > max_width or height > max_height:
+        # Calculate resize ratio
+        ratio = min(max_width / width, max_height / height)
+        new_width = int(width * ratio)
+        new_height = int(height * ratio)
+        
+        print(f"Resizing image from {width}x{height} to {new_width}x{new_height}")
+        image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    
+    # Convert to RGB if necessary
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # Create white background
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        if image.mode == 'P':
+            image = image.convert('RGBA')
+        if image.mode in ('RGBA', 'LA'):
+            background.paste(image, mask=image.split()[-1])
+        else:
+            background.paste(image)
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    return image
+
+
+def encode_jpeg(image, quality):
+    """Encode an RGB PIL image as an optimized progressive JPEG"""
+    compressed_image_buffer = io.BytesIO()
+    image.save(
+        compressed_image_buffer, 
+        format='JPEG', 
+        quality=quality, 
+        optimize=True,
+        progressive=True
+    )
+    return compressed_image_buffer.getvalue()
+
+
+def replace_image_stream(doc, xref, jpeg_bytes, width, height):
+    """Swap an image XObject's stream for JPEG data and update its dictionary to match"""
+    # Store the JPEG bytes as-is; they are already compressed
+    doc.update_stream(xref, jpeg_bytes, compress=False)
+    doc.xref_set_key(xref, "Filter", "/DCTDecode")
+    doc.xref_set_key(xref, "DecodeParms", "null")
+    doc.xref_set_key(xref, "Decode", "null")
+    doc.xref_set_key(xref, "Width", str(width))
+    doc.xref_set_key(xref, "Height", str(height))
+    doc.xref_set_key(xref, "ColorSpace", "/DeviceRGB")
+    doc.xref_set_key(xref, "BitsPerComponent", "8")
+
+
+def compress_pdf_fallback(input_path, output_path, compression_level, password=None, linearize=False):
+    """Fallback compression using pikepdf only; returns the path of the result"""
+    try:
+        print("Using pikepdf fallback compression")
         
-        with pikepdf.Pdf.open(input_stream) as pdf:
+        # Open PDF from disk
+        with pikepdf.Pdf.open(input_path) as pdf:
             # Remove unused resources
             try:
                 pdf.remove_unreferenced_resources()
@@ -1145,35 +2035,27 @@ def compress_pdf_fallback(pdf_content, compression_level):
                 except:
                     pass
             
-            # Save with compression
-            pdf.save(
-                output_stream,
-                compress_streams=True,
-                object_stream_mode=pikepdf.ObjectStreamMode.generate,
-                normalize_content=True
-            )
+            # Save with compression (and encryption/linearization if requested)
+            save_pdf_output(pdf, output_path, password, linearize)
         
-        compressed_content = output_stream.getvalue()
-        print(f"Pikepdf compression: {len(pdf_content)} -> {len(compressed_content)} bytes")
-        return compressed_content
+        print(f"Pikepdf compression: {os.path.getsize(input_path)} -> {os.path.getsize(output_path)} bytes")
+        return output_path
         
     except Exception as e:
         print(f"Fallback compression failed: {e}")
-        # Return original content if all compression fails
-        return pdf_content
+        # Return original file if all compression fails
+        return input_path
 
 
-def add_password_protection(pdf_content, password):
-    """Add password protection to PDF content"""
-    try:
-        input_stream = io.BytesIO(pdf_content)
-        output_stream = io.BytesIO()
-        
-        with pikepdf.Pdf.open(input_stream) as pdf:
+def save_pdf_output(pdf, output_path, password=None, linearize=False, garbage=4):
+    """Single output stage: clean up, compress and optionally encrypt (AES-256) and linearize a fitz or pikepdf document"""
+    if isinstance(pdf, pikepdf.Pdf):
+        encryption = None
+        if password:
             encryption = pikepdf.Encryption(
                 owner=password,
                 user=password,
-                R=6,
+                R=6, # AES-256 encryption
                 allow=pikepdf.Permissions(
                     accessibility=True,
                     extract=True,
@@ -1185,13 +2067,55 @@ def add_password_protection(pdf_content, password):
                     print_lowres=True
                 )
             )
-            pdf.save(output_stream, encryption=encryption)
-        
-        return output_stream.getvalue()
-        
-    except Exception as e:
-        print(f"Password protection failed: {e}")
-        return pdf_content
+        pdf.save(
+            output_path,
+            compress_streams=True,
+            object_stream_mode=pikepdf.ObjectStreamMode.generate,
+            # No normalize_content: it rewrites content streams uncompressed-first and
+            # made text-only PDFs several times larger
+            encryption=encryption,
+            linearize=linearize
+        )
+        return output_path
+
+    if linearize:
+        # MuPDF no longer linearizes, so qpdf writes the final file: fitz garbage-collects
+        # and deflates into a temp file, then pikepdf linearizes (and encrypts) it in one save
+        fd, tmp_path = tempfile.mkstemp(suffix='.pdf', dir=os.path.dirname(output_path) if isinstance(output_path, str) else None)
+        os.close(fd)
+        try:
+            save_pdf_output(pdf, tmp_path, garbage=garbage)
+            with pikepdf.Pdf.open(tmp_path) as linear_pdf:
+                save_pdf_output(linear_pdf, output_path, password, linearize=True)
+        finally:
+            os.remove(tmp_path)
+        return output_path
+
+    options = {}
+    if password:
+        # Same permissions as the pikepdf branch: no page assembly or other modification
+        options = {
+            'encryption': fitz.PDF_ENCRYPT_AES_256,
+            'owner_pw': password,
+            'user_pw': password,
+            'permissions': (
+                fitz.PDF_PERM_ACCESSIBILITY | fitz.PDF_PERM_COPY | fitz.PDF_PERM_ANNOTATE |
+                fitz.PDF_PERM_FORM | fitz.PDF_PERM_PRINT | fitz.PDF_PERM_PRINT_HQ
+            )
+        }
+    pdf.save(
+        output_path,
+        garbage=garbage,  # Remove unused objects (and, at 4, merge duplicates)
+        deflate=True,  # Compress content streams
+        clean=True,  # Clean up the file structure
+        ascii=False,  # Use binary encoding
+        expand=0,  # Don't expand content streams
+        linear=False,  # MuPDF can't linearize; handled above
+        pretty=False,  # Don't pretty-print
+        use_objstms=1,  # Pack small objects into compressed object streams
+        **options
+    )
+    return output_path
 
 # --- Unit Converter Data and Logic ---
 UNIT_CATEGORIES = {
@@ -1345,6 +2269,16 @@ def convert_images_to_pdf():
     jpeg_quality = int(request.form.get('jpegQuality', 90))
     password = request.form.get('password')
 
+    # Optional resolution to downsample images to, at the size they are drawn on the page
+    target_dpi = None
+    if request.form.get('targetDpi', '').strip():
+        try:
+            target_dpi = int(request.form['targetDpi'])
+        except ValueError:
+            target_dpi = 0
+        if not (72 <= target_dpi <= 600):
+            return jsonify({"success": False, "message": "Target DPI must be between 72 and 600."}), 400
+
     custom_width = None
     custom_height = None
     if page_size_str == 'Custom':
@@ -1370,133 +2304,154 @@ def convert_images_to_pdf():
     if page_orientation == 'landscape':
         page_size = (page_size[1], page_size[0]) # Swap width and height for landscape
 
-    output_buffer = io.BytesIO()
-    c = canvas.Canvas(output_buffer, pagesize=page_size)
+    protect = bool(password and password.strip())
+    linearize = form_flag('linearize')
+
+    # Spool every upload to disk so the whole batch can be hashed for the result cache;
+    # the images are read back one at a time while the PDF is written
+    workdir = make_request_workdir()
+    image_uploads = [
+        (image_file.filename, spool_upload(image_file, workdir, f'image-{i}'))
+        for i, image_file in enumerate(images)
+    ]
+
+    # Identical batches with the same layout settings are served from the result cache.
+    # Password-protected output is never cached.
+    cache_key = None
+    if not protect:
+        cache_key = result_cache_key('convert-images-to-pdf', [hash_file(path) for _, path in image_uploads], {
+            'page_size': [round(dimension, 2) for dimension in page_size],
+            'fit': image_fit if image_fit in ('fit', 'fill') else 'original',
+            'quality': jpeg_quality,
+            'target_dpi': target_dpi,
+            'linearize': linearize
+        })
+    cached_path, meta = result_cache.get(cache_key)
+    if cached_path:
+        print(f"Serving cached image-to-PDF result for {len(image_uploads)} images")
+        return send_result(cached_path, meta, 'application/pdf', 'converted_images.pdf', {
+            'X-Converted-Filename': 'converted_images.pdf'
+        })
 
-    try:
-        for i, image_file in enumerate(images):
-            try:
-                img_stream = io.BytesIO(image_file.read())
-                img = Image.open(img_stream)
-
-                # Convert image to RGB if it's not (e.g., RGBA, P)
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    # Create a white background image
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA') # Convert paletted to RGBA first
-                    background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                    img = background
-                elif img.mode != 'RGB':
-                    img = img.convert('RGB')
-
-                # Save as JPEG to a new buffer to control quality and format
-                temp_img_buffer = io.BytesIO()
-                img.save(temp_img_buffer, format='JPEG', quality=jpeg_quality)
-                temp_img_buffer.seek(0) # Rewind buffer
-
-                # Create ReportLab ImageReader
-                reportlab_img = ImageReader(temp_img_buffer)
-
-                # Calculate image position and size on PDF page
-                img_width, img_height = reportlab_img.getSize()
-                page_width, page_height = page_size
-
-                if image_fit == 'fit':
-                    # Scale image to fit within page, maintaining aspect ratio
-                    aspect_ratio = img_width / img_height
-                    if page_width / page_height > aspect_ratio:
-                        # Page is wider than image, fit by height
-                        draw_height = page_height
-                        draw_width = page_height * aspect_ratio
-                    else:
-                        # Page is taller than image, fit by width
-                        draw_width = page_width
-                        draw_height = page_width / aspect_ratio
-                elif image_fit == 'fill':
-                    # Scale image to fill page, potentially cropping
-                    aspect_ratio = img_width / img_height
-                    if page_width / page_height < aspect_ratio:
-                        # Page is taller than image, fill by height (will crop width)
-                        draw_height = page_height
-                        draw_width = page_height * aspect_ratio
-                    else:
-                        # Page is wider than image, fill by width (will crop height)
-                        draw_width = page_width
-                        draw_height = page_width / aspect_ratio
-                else: # original
-                    draw_width = img_width
-                    draw_height = img_height
-
-                # Center the image on the page
-                x = (page_width - draw_width) / 2
-                y = (page_height - draw_height) / 2
-
-                c.drawImage(reportlab_img, x, y, width=draw_width, height=draw_height)
-                
-                if i < len(images) - 1: # Add new page for all but the last image
-                    c.showPage()
+    # Decoding and encoding the images happens on a thread pool (Pillow releases the GIL
+    # for both); the pages are written in upload order as the prepared images come in
+    def prepare(upload):
+        image_filename, image_path = upload
+        try:
+            return prepare_pdf_image(image_path, jpeg_quality, page_size, image_fit, target_dpi)
+        except Exception as e:
+            print(f"Error processing image {image_filename}: {e}")
+            return None
 
-            except Exception as e:
-                print(f"Error processing image {image_file.filename}: {e}")
-                # Decide how to handle errors: skip image, return error, etc.
-                # For now, we'll just log and continue, but a more robust solution might skip or fail.
-                continue
+    workers = max(1, min(IMAGES_TO_PDF_WORKERS, len(image_uploads)))
 
-        c.save()
-        output_buffer.seek(0)
+    try:
+        # Each page goes straight to disk, so memory doesn't grow with the size of the batch
+        result_path = os.path.join(workdir, 'converted_images.pdf')
+        with open(result_path, 'wb') as f, StreamingImagePdfWriter(f) as pdf_writer:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                prepared_images = ordered_map(prepare, image_uploads, executor if workers > 1 else None, window=workers * 2)
+                for (image_filename, _), prepared in prepared_images:
+                    if prepared is None:
+                        continue
+                    jpeg_bytes, image_size, grayscale = prepared
+
+                    # Calculate image position and size on PDF page
+                    draw_width, draw_height = image_draw_size(image_size, page_size, image_fit)
+                    page_width, page_height = page_size
+
+                    # Center the image on the page
+                    x = (page_width - draw_width) / 2
+                    y = (page_height - draw_height) / 2
+
+                    pdf_writer.add_page(page_size, jpeg_bytes, image_size, grayscale, (x, y, draw_width, draw_height))
+            page_count = pdf_writer.page_count
 
-        final_pdf_content = output_buffer.getvalue()
+        if page_count == 0:
+            return jsonify({"success": False, "message": "None of the images could be converted."}), 400
 
-        # Add password protection if requested
-        if password and password.strip():
-            final_pdf_content = add_password_protection_reportlab(final_pdf_content, password)
+        # Add password protection and/or linearization if requested, compressing in the same pikepdf save
+        if protect or linearize:
+            try:
+                protected_path = os.path.join(workdir, 'protected.pdf')
+                with pikepdf.Pdf.open(result_path) as pdf:
+                    save_pdf_output(pdf, protected_path, password if protect else None, linearize)
+                result_path = protected_path
+            except Exception as e:
+                print(f"Password protection/linearization failed for image-to-pdf: {e}")
+                # If this fails, return the plain PDF
 
-        response = make_response(send_file(
-            io.BytesIO(final_pdf_content),
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name='converted_images.pdf'
-        ))
-        response.headers['X-Converted-Filename'] = 'converted_images.pdf' # Custom header for filename
-        response.headers['Access-Control-Expose-Headers'] = 'X-Converted-Filename' # Expose custom header
+        cached_path, meta = result_cache.put_file(cache_key, result_path)
 
-        return response
+        return send_result(cached_path or result_path, meta, 'application/pdf', 'converted_images.pdf', {
+            'X-Converted-Filename': 'converted_images.pdf' # Custom header for filename
+        })
 
     except Exception as e:
         print(f"Error during image to PDF conversion: {e}")
         return jsonify({"success": False, "message": f"Conversion failed: {str(e)}"}), 500
 
-def add_password_protection_reportlab(pdf_content, password):
-    """Add password protection to PDF content using pikepdf (more robust than ReportLab's built-in)"""
-    try:
-        input_stream = io.BytesIO(pdf_content)
-        output_stream = io.BytesIO()
 
-        with pikepdf.Pdf.open(input_stream) as pdf:
-            encryption = pikepdf.Encryption(
-                owner=password,
-                user=password,
-                R=6, # AES-256 encryption
-                allow=pikepdf.Permissions(
-                    accessibility=True,
-                    extract=True,
-                    modify_annotation=True,
-                    modify_assembly=False,
-                    modify_form=True,
-                    modify_other=False,
-                    print_highres=True,
-                    print_lowres=True
-                )
-            )
-            pdf.save(output_stream, encryption=encryption)
+def image_draw_size(image_size, page_size, image_fit):
+    """Size in points an image of image_size pixels is drawn at on a page of page_size"""
+    img_width, img_height = image_size
+    page_width, page_height = page_size
+
+    if image_fit == 'fit':
+        # Scale image to fit within page, maintaining aspect ratio
+        aspect_ratio = img_width / img_height
+        if page_width / page_height > aspect_ratio:
+            # Page is wider than image, fit by height
+            return page_height * aspect_ratio, page_height
+        # Page is taller than image, fit by width
+        return page_width, page_width / aspect_ratio
+    if image_fit == 'fill':
+        # Scale image to fill page, potentially cropping
+        aspect_ratio = img_width / img_height
+        if page_width / page_height < aspect_ratio:
+            # Page is taller than image, fill by height (will crop width)
+            return page_height * aspect_ratio, page_height
+        # Page is wider than image, fill by width (will crop height)
+        return page_width, page_width / aspect_ratio
+    # original
+    return img_width, img_height
+
+
+def prepare_pdf_image(image_path, jpeg_quality, page_size, image_fit, target_dpi=None):
+    """Prepare an uploaded image for its PDF page, returning (jpeg_bytes, (width, height), grayscale)"""
+    with open(image_path, 'rb') as f:
+        image_content = f.read()
+    img = Image.open(io.BytesIO(image_content))
+    max_size = None
+    if target_dpi:
+        draw_width, draw_height = image_draw_size(img.size, page_size, image_fit)
+        max_size = (max(1, round(draw_width * target_dpi / 72)), max(1, round(draw_height * target_dpi / 72)))
+        if img.width <= max_size[0] and img.height <= max_size[1]:
+            max_size = None
+
+    if max_size is None:
+        if jpeg_passthrough(img, image_content, jpeg_quality):
+            return image_content, img.size, img.mode == 'L'
+        max_size = img.size
+    else:
+        # Reopen with draft mode so big JPEGs are never decoded at full size
+        img = open_image(image_content, max_size)
 
-        return output_stream.getvalue()
+    # Downscale and convert image to RGB if it's not (e.g., RGBA, P)
+    img = prepare_image(img, max_size)
 
-    except Exception as e:
-        print(f"Password protection failed for image-to-pdf: {e}")
-        # If password protection fails, return the unencrypted PDF
-        return pdf_content
+    # Save as JPEG to a new buffer to control quality and format
+    temp_img_buffer = io.BytesIO()
+    img.save(temp_img_buffer, format='JPEG', quality=jpeg_quality)
+    return temp_img_buffer.getvalue(), img.size, False
+
+
+def jpeg_passthrough(img, image_bytes, jpeg_quality):
+    """Whether an opened image is a baseline RGB or grayscale JPEG no better than jpeg_quality"""
+    if img.format != 'JPEG' or img.mode not in ('RGB', 'L') or img.info.get('progressive'):
+        return False
+    source_quality = estimate_jpeg_quality(image_bytes)
+    return source_quality is not None and source_quality <= jpeg_quality
 
 # ... (rest of your existing app.py code) ...
 
@@ -1520,6 +2475,9 @@ def convert_pdf_to_images():
     image_quality = int(request.form.get('imageQuality', 90))
     dpi = int(request.form.get('dpi', 150))
     download_option = request.form.get('downloadOption', 'zip')
+    # Optional page ranges such as "1-3,7"; individual downloads return the first of them
+    pages = request.form.get('pages', '').strip() or None
+    grayscale = form_flag('grayscale')
 
     # Validate parameters
     if image_format not in ['png', 'jpeg']:
@@ -1532,93 +2490,392 @@ def convert_pdf_to_images():
         return jsonify({"success": False, "message": "Invalid download option. Use 'zip' or 'individual'."}), 400
 
     try:
-        # Read PDF file into memory
-        pdf_content = pdf_file.read()
+        # Spool the upload to disk; fitz opens it by path. ZIPs are sent page by page while they are rendered
+        args = lambda input_path, workdir: (input_path, workdir, pdf_file.filename, image_format, image_quality, dpi, download_option)
+        return dispatch_upload('convert-pdf-to-images', pdf_file, run_pdf_to_images, args, stream=True, pages=pages, grayscale=grayscale)
 
-        # Open PDF with PyMuPDF
-        pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
-        page_count = pdf_document.page_count
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        print(f"Error during PDF to image conversion: {e}")
+        return jsonify({"success": False, "message": f"Conversion failed: {str(e)}"}), 500
 
-        if page_count == 0:
-            pdf_document.close()
-            return jsonify({"success": False, "message": "No pages found in the PDF."}), 400
 
-        images = []
-        # Convert each page to an image
-        for page_num in range(page_count):
-            page = pdf_document.load_page(page_num)
-            # Set zoom factor based on DPI (1 pixel = 1/72 inch at 72 DPI)
-            zoom = dpi / 72
-            matrix = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=matrix)
-            
-            # Convert PyMuPDF pixmap to PIL Image
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            images.append(img)
+def run_pdf_to_images(input_path, workdir, filename, image_format, image_quality, dpi, download_option, progress=None, pages=None, grayscale=False, stream=False):
+    """Render a spooled PDF's pages to images (or fetch them from the result cache); returns the send_result arguments"""
+    if download_option == 'zip':
+        mimetype, download_name = 'application/zip', 'converted_images.zip'
+    else:
+        mimetype, download_name = f'image/{image_format}', f'page_1.{image_format}'
+
+    # Repeat conversions with the same settings are served from the result cache
+    doc_id = hash_file(input_path)
+    cache_key = result_cache_key('convert-pdf-to-images', [doc_id], {
+        'format': image_format,
+        'quality': image_quality if image_format == 'jpeg' else None,
+        'dpi': dpi,
+        'download': download_option,
+        'pages': ''.join(pages.split()) if pages else None,
+        'grayscale': grayscale
+    })
+    cached_path, meta = result_cache.get(cache_key)
+    if cached_path:
+        print(f"Serving cached PDF to image conversion of {filename}")
+        download_name = meta.get('download_name', download_name)
+        return {
+            'content': cached_path,
+            'meta': meta,
+            'mimetype': mimetype,
+            'download_name': download_name,
+            'headers': {
+                'X-Converted-Filename': download_name,
+                'X-Page-Count': str(meta.get('page_count', 0))
+            }
+        }
+
+    # Open PDF with PyMuPDF
+    pdf_document = fitz.open(input_path)
+    page_count = pdf_document.page_count
 
+    if page_count == 0:
         pdf_document.close()
+        raise ValueError("No pages found in the PDF.")
 
-        if download_option == 'zip':
-            # Create ZIP file in memory
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for i, img in enumerate(images):
-                    # Convert image to RGB if needed (e.g., for JPEG)
-                    if image_format == 'jpeg' and img.mode != 'RGB':
-                        img = img.convert('RGB')
-
-                    # Save image to buffer
-                    img_buffer = io.BytesIO()
-                    if image_format == 'jpeg':
-                        img.save(img_buffer, format='JPEG', quality=image_quality)
-                    else:
-                        img.save(img_buffer, format='PNG')
-                    img_buffer.seek(0)
-
-                    # Write to ZIP
-                    zip_file.writestr(f'page_{i + 1}.{image_format}', img_buffer.getvalue())
-
-            zip_buffer.seek(0)
-
-            # Prepare response
-            response = make_response(send_file(
-                zip_buffer,
-                mimetype='application/zip',
-                as_attachment=True,
-                download_name='converted_images.zip'
-            ))
-            response.headers['X-Converted-Filename'] = 'converted_images.zip'
-            response.headers['X-Page-Count'] = str(len(images))
-            response.headers['Access-Control-Expose-Headers'] = 'X-Converted-Filename,X-Page-Count'
-            return response
-
-        else:  # download_option == 'individual'
-            # Return the first page as an image (client expects single blob)
-            img = images[0]
-            if image_format == 'jpeg' and img.mode != 'RGB':
-                img = img.convert('RGB')
-
-            img_buffer = io.BytesIO()
-            if image_format == 'jpeg':
-                img.save(img_buffer, format='JPEG', quality=image_quality)
-            else:
-                img.save(img_buffer, format='PNG')
-            img_buffer.seek(0)
-
-            response = make_response(send_file(
-                img_buffer,
-                mimetype=f'image/{image_format}',
-                as_attachment=True,
-                download_name=f'page_1.{image_format}'
-            ))
-            response.headers['X-Converted-Filename'] = f'page_1.{image_format}'
-            response.headers['X-Page-Count'] = str(len(images))
-            response.headers['Access-Control-Expose-Headers'] = 'X-Converted-Filename,X-Page-Count'
-            return response
+    # Render and encode only the requested pages (on a process pool for big jobs),
+    # in page order; individual downloads only ever return the first of them
+    try:
+        page_numbers = parse_page_ranges(pages, page_count) if pages else range(page_count)
+    except ValueError:
+        pdf_document.close()
+        raise
+    if download_option != 'zip':
+        page_numbers = page_numbers[:1]
+        download_name = f'page_{page_numbers[0] + 1}.{image_format}'
+    # Headers, progress and cached meta report the pages actually converted
+    converted_count = len(page_numbers)
+    workers = raster_workers(pdf_document, converted_count, dpi)
+    pdf_document.close()
+    rendered_pages = iter_rendered_pages(
+        input_path, page_numbers, dpi, image_format, image_quality, workers, progress, grayscale, doc_id
+    )
+
+    result_path = os.path.join(workdir, download_name)
+    headers = {
+        'X-Converted-Filename': download_name,
+        'X-Page-Count': str(converted_count)
+    }
+    if download_option == 'zip':
+        zip_chunks = iter_pages_zip(rendered_pages, image_format, result_path)
+        if stream:
+            return streamed_result(
+                zip_chunks, result_path, cache_key, {'page_count': converted_count, 'download_name': download_name},
+                mimetype, download_name, headers
+            )
+
+        # Create ZIP file on disk
+        for _ in zip_chunks:
+            pass
+
+    else:  # download_option == 'individual'
+        # Return the first page as an image (client expects single blob)
+        _, image_bytes = next(rendered_pages)
+        with open(result_path, 'wb') as f:
+            f.write(image_bytes)
+
+    if progress:
+        progress(converted_count, converted_count)
+
+    # Prepare response
+    cached_path, meta = result_cache.put_file(cache_key, result_path, {'page_count': converted_count, 'download_name': download_name})
+    return {
+        'content': cached_path or result_path,
+        'meta': meta,
+        'mimetype': mimetype,
+        'download_name': download_name,
+        'headers': headers
+    }
+
+
+def parse_page_ranges(spec, page_count):
+    """Parse a page range spec like "1-3,7,10-" into sorted 0-based page numbers, raising ValueError if invalid"""
+    page_numbers = set()
+    for part in spec.replace(' ', '').split(','):
+        if not part:
+            continue
+        start, dash, end = part.partition('-')
+        try:
+            first = int(start) if start else 1
+            last = (int(end) if end else page_count) if dash else first
+        except ValueError:
+            first = last = None
+        if first is None or first > last:
+            raise ValueError(f"Invalid page range '{part}'. Use page numbers like 1-3,7.")
+        if not 1 <= first <= last <= page_count:
+            raise ValueError(f"Page range '{part}' is outside the document's {page_count} pages.")
+        page_numbers.update(range(first - 1, last))
+    if not page_numbers:
+        raise ValueError("No pages selected.")
+    return sorted(page_numbers)
+
+
+# Without tell() or seek(), zipfile writes the archive front to back with data
+# descriptors, which is what lets it be sent while it is built
+class ZipChunkWriter:
+    """Write-only file object for zipfile that collects the written bytes and copies them to a file"""
+
+    def __init__(self, copy_to):
+        self.copy_to = copy_to
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.copy_to.write(data)
+        return len(data)
+
+    def flush(self):
+        self.copy_to.flush()
+
+    def take(self):
+        """The bytes written since the last call"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_pages_zip(rendered_pages, image_format, zip_path):
+    """Build a ZIP of (page_num, image_bytes) pages, yielding it in chunks as each page is added and writing it to zip_path"""
+    with open(zip_path, 'wb') as f:
+        out = ZipChunkWriter(f)
+        # PNG and JPEG data is already compressed, so entries are stored as-is
+        with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED) as zip_file:
+            for page_num, image_bytes in rendered_pages:
+                zip_file.writestr(f'page_{page_num + 1}.{image_format}', image_bytes)
+                yield out.take()
+        yield out.take()
+
+
+def raster_workers(doc, page_count, dpi):
+    """Worker processes for rendering page_count pages at dpi: 1 (serial) unless the job is big enough"""
+    if PDF_RASTER_WORKERS <= 1 or page_count < 2:
+        return 1
+    # Estimate the work from the first page's size; pool start-up only pays off on big jobs
+    rect = doc.load_page(0).rect
+    megapixels = rect.width * rect.height * (dpi / 72) ** 2 / 1e6 * page_count
+    if megapixels < PDF_RASTER_MIN_POOL_MEGAPIXELS:
+        return 1
+    workers = min(PDF_RASTER_WORKERS, page_count)
+    if PDF_RASTER_MIN_POOL_MEGAPIXELS > 0:
+        # Give every worker at least half the minimum amount of work
+        workers = min(workers, int(megapixels * 2 // PDF_RASTER_MIN_POOL_MEGAPIXELS))
+    return max(1, workers)
+
+
+def iter_rendered_pages(input_path, page_numbers, dpi, image_format, image_quality, workers=1, progress=None, grayscale=False, doc_id=None):
+    """Render and encode pages (on a process pool with several workers), yielding (page_num, image_bytes) in order"""
+    page_numbers = list(page_numbers)
+    total = len(page_numbers)
+    if workers <= 1:
+        doc = fitz.open(input_path)
+        try:
+            for done, page_num in enumerate(page_numbers):
+                if progress:
+                    progress(done, total)
+                yield page_num, render_page_image(doc, page_num, dpi, image_format, image_quality, grayscale, doc_id)
+        finally:
+            doc.close()
+        return
+
+    print(f"Rendering {total} pages at {dpi} DPI with {workers} workers")
+    # Ranges of one or two pages, one per worker in flight, bound the rendered pages held while streaming
+    chunk_size = max(1, min(2, -(-total // (workers * 4))))
+    chunks = [page_numbers[i:i + chunk_size] for i in range(0, total, chunk_size)]
+    render = partial(
+        _render_worker_pages,
+        dpi=dpi, image_format=image_format, image_quality=image_quality, grayscale=grayscale, doc_id=doc_id
+    )
+
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_image_worker, initargs=(input_path,))
+    try:
+        done = 0
+        for chunk, encoded_pages in ordered_map(render, chunks, executor, window=workers):
+            for page_num, image_bytes in zip(chunk, encoded_pages):
+                if progress:
+                    progress(done, total)
+                done += 1
+                yield page_num, image_bytes
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def _render_worker_pages(page_numbers, dpi, image_format, image_quality, grayscale=False, doc_id=None):
+    """Pool entry point: render and encode a range of pages from the worker's own copy of the document"""
+    return [
+        render_page_image(_image_worker_doc, page_num, dpi, image_format, image_quality, grayscale, doc_id)
+        for page_num in page_numbers
+    ]
+
+
+def page_cache_key(doc_id, page_num, dpi, grayscale=False):
+    """Rendered-page cache key: document hash, 0-based page number, DPI and colorspace"""
+    return make_cache_key('rendered-page', [doc_id], {
+        'page': page_num,
+        'dpi': dpi,
+        'colorspace': 'gray' if grayscale else 'rgb'
+    })
+
+
+def render_page_image(doc, page_num, dpi, image_format, image_quality=90, grayscale=False, doc_id=None):
+    """Render one page at dpi as image_format bytes, reusing the rendered-page cache when given doc_id"""
+    cache_key = page_cache_key(doc_id, page_num, dpi, grayscale) if doc_id else None
+    cached_path, meta = page_cache.get(cache_key)
+    if cached_path and image_format != 'png':
+        decode_seconds = meta.get('megapixels', 0) * PNG_DECODE_SECONDS_PER_MEGAPIXEL
+        if meta.get('render_seconds', 0) < decode_seconds:
+            cached_path = None
+    if cached_path:
+        try:
+            with open(cached_path, 'rb') as f:
+                png_bytes = f.read()
+        except OSError:
+            # Evicted in the meantime
+            png_bytes = None
+        if png_bytes:
+            if image_format == 'png':
+                return png_bytes
+            return encode_image(Image.open(io.BytesIO(png_bytes)), image_format, image_quality)
+
+    started = time.time()
+    pix = render_page_pixmap(doc.load_page(page_num), dpi, grayscale)
+    render_seconds = time.time() - started
+    image_bytes = encode_pixmap(pix, image_format, image_quality)
+    if cache_key and image_format == 'png':
+        page_cache.put_bytes(cache_key, image_bytes, {
+            'render_seconds': render_seconds,
+            'megapixels': pix.width * pix.height / 1e6
+        })
+    return image_bytes
+
+
+def render_page_pixmap(page, dpi, grayscale=False):
+    """Render a page at dpi straight to an 8-bit gray or RGB pixmap, never with alpha"""
+    # Set zoom factor based on DPI (1 pixel = 1/72 inch at 72 DPI)
+    zoom = dpi / 72
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+
+
+def encode_pixmap(pix, image_format, image_quality=90):
+    """Encode a gray or RGB pixmap without alpha (see encode_image for the formats)"""
+    # Pillow's encoders beat MuPDF's own (Pixmap.tobytes) on both speed and size
+    return encode_image(pixmap_image(pix), image_format, image_quality)
+
+
+def pixmap_image(pix):
+    """A PIL image over a gray or RGB pixmap's samples (no copy; only valid while pix is alive)"""
+    mode = 'L' if pix.n == 1 else 'RGB'
+    return Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, 'raw', mode, pix.stride, 1)
+
+
+def encode_image(image, image_format, image_quality=90):
+    """Encode a gray or RGB PIL image as 'png', 'png8' (256-colour palette PNG) or 'jpeg' bytes"""
+    buffer = io.BytesIO()
+    if image_format == 'jpeg':
+        image.save(buffer, format='JPEG', quality=image_quality)
+    else:
+        if image_format == 'png8' and image.mode != 'L':
+            # Rendered text and line art rarely use more colours than a palette holds
+            image = image.quantize(256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+        image.save(buffer, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+    return buffer.getvalue()
+
+
+def pdf_document_cache_key(doc_id):
+    """Cache key under which an uploaded PDF is kept for rendering thumbnails"""
+    return result_cache_key('pdf-document', [doc_id], None)
+
+
+@app.route('/api/pdf-thumbnails', methods=['POST'])
+def upload_pdf_for_thumbnails():
+    """Keep an uploaded PDF so thumbnails of its pages can be fetched without re-uploading it"""
+    if 'user' not in session:
+        return jsonify({"success": False, "message": "Authentication required."}), 401
+
+    pdf_file = request.files.get('pdf')
+    if not pdf_file or pdf_file.filename == '':
+        return jsonify({"success": False, "message": "No PDF file provided."}), 400
+
+    try:
+        workdir = make_request_workdir()
+        input_path = spool_upload(pdf_file, workdir)
+        doc_id = hash_file(input_path)
+
+        doc = fitz.open(input_path)
+        page_count = doc.page_count
+        doc.close()
+        if page_count == 0:
+            return jsonify({"success": False, "message": "No pages found in the PDF."}), 400
+
+        # The document lives in the result cache (keyed by its hash) until it is evicted
+        stored_path, _ = result_cache.put_file(pdf_document_cache_key(doc_id), input_path, {'page_count': page_count})
+        if not stored_path:
+            return jsonify({"success": False, "message": "Thumbnails are not available right now."}), 503
+        return jsonify({
+            "success": True,
+            "document": {
+                "id": doc_id,
+                "page_count": page_count,
+                "thumbnail_url": f"/api/pdf-thumbnails/{doc_id}/{{page}}"
+            }
+        })
 
     except Exception as e:
-        print(f"Error during PDF to image conversion: {e}")
-        return jsonify({"success": False, "message": f"Conversion failed: {str(e)}"}), 500
+        print(f"Error storing PDF for thumbnails: {e}")
+        return jsonify({"success": False, "message": f"Could not read the PDF: {str(e)}"}), 400
+
+
+@app.route('/api/pdf-thumbnails/<doc_id>/<int:page>', methods=['GET'])
+def pdf_thumbnail(doc_id, page):
+    """A low-resolution PNG of one page (1-based) of a PDF uploaded to /api/pdf-thumbnails"""
+    if 'user' not in session:
+        return jsonify({"success": False, "message": "Authentication required."}), 401
+
+    dpi = request.args.get('dpi', THUMBNAIL_DPI, type=int)
+    if not dpi or not 1 <= dpi <= THUMBNAIL_MAX_DPI:
+        return jsonify({"success": False, "message": f"DPI must be between 1 and {THUMBNAIL_MAX_DPI}."}), 400
+    if not re.fullmatch(r'[0-9a-f]{64}', doc_id):
+        return jsonify({"success": False, "message": "Document not found or expired. Please upload it again."}), 404
+
+    # Thumbnails are ordinary low-DPI renders, kept in the rendered-page cache
+    cache_key = page_cache_key(doc_id, page - 1, dpi)
+    cached_path, meta = page_cache.get(cache_key)
+    if not cached_path:
+        doc_path, doc_meta = result_cache.get(pdf_document_cache_key(doc_id))
+        if not doc_path:
+            return jsonify({"success": False, "message": "Document not found or expired. Please upload it again."}), 404
+        if not 1 <= page <= doc_meta.get('page_count', 0):
+            return jsonify({"success": False, "message": "Page not found."}), 404
+
+        try:
+            doc = fitz.open(doc_path)
+            try:
+                image_bytes = render_page_image(doc, page - 1, dpi, 'png', doc_id=doc_id)
+            finally:
+                doc.close()
+        except Exception as e:
+            print(f"Error rendering thumbnail of page {page}: {e}")
+            return jsonify({"success": False, "message": f"Rendering failed: {str(e)}"}), 500
+
+        cached_path, meta = page_cache.get(cache_key)
+        if not cached_path:
+            cached_path, meta = image_bytes, None
+
+    return send_result(
+        content=cached_path,
+        meta=meta,
+        mimetype='image/png',
+        download_name=f'page_{page}.png',
+        headers={}
+    )
 
 @app.route('/api/convert-pdf-to-word', methods=['POST'])
 def convert_pdf_to_word():
@@ -1636,86 +2893,368 @@ def convert_pdf_to_word():
 
     # Get form parameters
     layout_preservation = request.form.get('layoutPreservation', 'full').lower()
+    ocr_language = request.form.get('ocrLanguage', 'eng') if form_flag('ocrEnabled') else None
 
     # Validate parameters
-    if layout_preservation not in ['full', 'text']:
-        return jsonify({"success": False, "message": "Invalid layout preservation option. Use 'full' or 'text'."}), 400
+    if layout_preservation not in ['full', 'hybrid', 'text']:
+        return jsonify({"success": False, "message": "Invalid layout preservation option. Use 'full', 'hybrid' or 'text'."}), 400
+    if ocr_language is not None and ocr_language not in OCR_LANGUAGES:
+        return jsonify({"success": False, "message": f"Unsupported OCR language. Use one of: {', '.join(OCR_LANGUAGES)}."}), 400
 
     try:
-        # Read PDF file into memory
-        pdf_content = pdf_file.read()
+        # Spool the upload to disk; fitz opens it by path. Text-only documents are sent page by page while they are written
+        args = lambda input_path, workdir: (input_path, workdir, pdf_file.filename, layout_preservation)
+        return dispatch_upload('convert-pdf-to-word', pdf_file, run_pdf_to_word, args, stream=True, ocr_language=ocr_language)
 
-        # Open PDF with PyMuPDF for page count and image rendering
-        pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
-        page_count = pdf_document.page_count
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        print(f"Error during PDF to Word conversion: {e}")
+        return jsonify({"success": False, "message": f"Conversion failed: {str(e)}"}), 500
 
-        if page_count == 0:
-            pdf_document.close()
-            return jsonify({"success": False, "message": "No pages found in the PDF."}), 400
 
-        # Initialize Word document
-        doc = Document()
-
-        # Try extracting text for text-based PDFs
-        pdf_reader = PdfReader(io.BytesIO(pdf_content))
-        text_content = ""
-        has_text = False
-
-        # Check if PDF has extractable text
-        for page in pdf_reader.pages:
-            text = page.extract_text()
-            if text and text.strip():
-                has_text = True
-                text_content += text + "\n\n"
-
-        if layout_preservation == 'full':
-            # Convert each page to an image and add text (if available)
-            for page_num in range(page_count):
-                page = pdf_document.load_page(page_num)
-                zoom = 300 / 72  # 300 DPI for high-quality images
-                matrix = fitz.Matrix(zoom, zoom)
-                pix = page.get_pixmap(matrix=matrix)
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                img_buffer = io.BytesIO()
-                img.save(img_buffer, format='PNG')
-                img_buffer.seek(0)
-                doc.add_picture(img_buffer, width=Inches(6.0))  # Adjust width as needed
-                if has_text:
-                    text = pdf_reader.pages[page_num].extract_text()
-                    if text and text.strip():
-                        doc.add_paragraph(text)
-                if page_num < page_count - 1:
-                    doc.add_page_break()
-        else:
-            # Text-only mode
-            if not has_text:
-                pdf_document.close()
-                return jsonify({"success": False, "message": "No extractable text found in the PDF for text-only mode."}), 400
-            doc.add_paragraph(text_content)
+def run_pdf_to_word(input_path, workdir, filename, layout_preservation, progress=None, ocr_language=None, stream=False):
+    """Convert a spooled PDF to .docx (or fetch it from the result cache); returns the send_result arguments"""
+    docx_mimetype = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+    output_filename = secure_filename(os.path.splitext(filename)[0] + '.docx')
+
+    # Repeat conversions with the same settings are served from the result cache
+    doc_id = hash_file(input_path)
+    cache_key = result_cache_key('convert-pdf-to-word', [doc_id], {'layout': layout_preservation, 'ocr': ocr_language})
+    cached_path, meta = result_cache.get(cache_key)
+    if cached_path:
+        print(f"Serving cached PDF to Word conversion of {filename}")
+        return {
+            'content': cached_path,
+            'meta': meta,
+            'mimetype': docx_mimetype,
+            'download_name': output_filename,
+            'headers': {
+                'X-Converted-Filename': output_filename,
+                'X-Page-Count': str(meta.get('page_count', 0))
+            }
+        }
+
+    # Open PDF with PyMuPDF for page count and image rendering
+    pdf_document = fitz.open(input_path)
+    page_count = pdf_document.page_count
 
+    if page_count == 0:
         pdf_document.close()
+        raise ValueError("No pages found in the PDF.")
+
+    # OCR pages that have no text layer up front, then build the document
+    ocr_texts = {}
+    if ocr_language:
+        # Found without extracting any text, which the conversion below does page by page
+        textless = [n for n in range(page_count) if not page_draws_text(pdf_document.load_page(n))]
+        if textless and progress:
+            # Report OCR and the page loop below as one sequence of steps
+            report = progress
+            total_steps = len(textless) + page_count
+            ocr_progress = lambda done, total: report(done, total_steps)
+            progress = lambda done, total: report(len(textless) + done, total_steps)
+        else:
+            ocr_progress = None
+        try:
+            ocr_texts = ocr_pages(pdf_document, input_path, textless, ocr_language, ocr_progress)
+        except pytesseract.TesseractNotFoundError:
+            print("Tesseract is not installed; converting without OCR")
+        except Exception as e:
+            print(f"OCR failed ({e}); converting without OCR")
+        if len(ocr_texts) < len(textless):
+            # Only cache conversions that have every page's OCR text
+            cache_key = None
+
+    result_path = os.path.join(workdir, 'converted.docx')
+    headers = {
+        'X-Converted-Filename': output_filename,
+        'X-Page-Count': str(page_count)
+    }
 
-        # Save Word document to buffer
-        doc_buffer = io.BytesIO()
-        doc.save(doc_buffer)
-        doc_buffer.seek(0)
+    if layout_preservation == 'text':
+        # Text-only documents are written out page by page instead of built in memory;
+        # the generator closes pdf_document once it is done with it
+        docx_chunks = iter_text_docx(pdf_document, ocr_texts, result_path, progress)
+        # Nothing comes out before a page with text, so a PDF without any
+        # still fails before a response has been started
+        first_chunk = next(docx_chunks, None)
+        if first_chunk is None:
+            if ocr_language:
+                raise ValueError("No text could be found or recognized in the PDF for text-only mode.")
+            raise ValueError("No extractable text found in the PDF for text-only mode. Enable OCR for scanned PDFs.")
+        if stream:
+            return streamed_result(
+                itertools.chain([first_chunk], docx_chunks), result_path, cache_key, {'page_count': page_count},
+                docx_mimetype, output_filename, headers
+            )
+        for _ in docx_chunks:
+            pass
+        return finish_word_result(result_path, cache_key, page_count, docx_mimetype, output_filename, headers, progress)
 
-        # Prepare response
-        output_filename = secure_filename(os.path.splitext(pdf_file.filename)[0] + '.docx')
-        response = make_response(send_file(
-            doc_buffer,
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            as_attachment=True,
-            download_name=output_filename
-        ))
-        response.headers['X-Converted-Filename'] = output_filename
-        response.headers['X-Page-Count'] = str(page_count)
-        response.headers['Access-Control-Expose-Headers'] = 'X-Converted-Filename,X-Page-Count'
-        return response
+    # Initialize Word document
+    doc = Document()
+
+    if layout_preservation == 'full':
+        # Convert each page to an image and add its text (if any), extracted in the same pass
+        for page_num in range(page_count):
+            if progress:
+                progress(page_num, page_count)
+            page = pdf_document.load_page(page_num)
+            # Sized for the 6-inch display width, shared with other endpoints through the page cache
+            image_bytes = render_page_image(
+                pdf_document, page_num, word_page_dpi(page), word_page_format(page), WORD_JPEG_QUALITY, doc_id=doc_id
+            )
+            doc.add_picture(io.BytesIO(image_bytes), width=Inches(6.0))
+            text = blocks_to_text(extract_page_text(page))
+            if not text.strip():
+                text = ocr_texts.get(page_num, '')
+            if text.strip():
+                doc.add_paragraph(text)
+            if page_num < page_count - 1:
+                doc.add_page_break()
+    elif layout_preservation == 'hybrid':
+        # Text flows as paragraphs; only the image regions of each page are rasterized
+        for page_num in range(page_count):
+            if progress:
+                progress(page_num, page_count)
+            page = pdf_document.load_page(page_num)
+            add_hybrid_page(doc, page, extract_page_text(page), ocr_texts.get(page_num))
+            if page_num < page_count - 1:
+                doc.add_page_break()
+
+    pdf_document.close()
+
+    # Save Word document to disk
+    doc.save(result_path)
+    return finish_word_result(result_path, cache_key, page_count, docx_mimetype, output_filename, headers, progress)
+
+
+def finish_word_result(result_path, cache_key, page_count, mimetype, download_name, headers, progress=None):
+    """Cache a finished .docx and return the send_result arguments for it"""
+    if progress:
+        progress(page_count, page_count)
+
+    # Prepare response
+    cached_path, meta = result_cache.put_file(cache_key, result_path, {'page_count': page_count})
+    return {
+        'content': cached_path or result_path,
+        'meta': meta,
+        'mimetype': mimetype,
+        'download_name': download_name,
+        'headers': headers
+    }
 
+
+def iter_text_docx(pdf_document, ocr_texts, docx_path, progress=None):
+    """Write each page's text to docx_path as a .docx, yielding its bytes once pages with text are added"""
+    page_count = pdf_document.page_count
+    has_text = False
+    try:
+        with open(docx_path, 'wb') as f:
+            out = ZipChunkWriter(f)
+            with StreamingDocxWriter(out) as docx_writer:
+                for page_num in range(page_count):
+                    if progress:
+                        progress(page_num, page_count)
+                    page = pdf_document.load_page(page_num)
+                    paragraphs = page_paragraphs(extract_page_text(page), ocr_texts.get(page_num))
+                    if not paragraphs:
+                        continue
+                    if has_text:
+                        docx_writer.add_page_break()
+                    for runs in paragraphs:
+                        docx_writer.add_paragraph(runs)
+                    has_text = True
+                    yield out.take()
+            if has_text:
+                yield out.take()
+    finally:
+        pdf_document.close()
+
+
+def page_paragraphs(blocks, ocr_text=None):
+    """A page's text blocks as paragraphs of (text, bold, italic) runs, or ocr_text's paragraphs if they have no text"""
+    paragraphs = [runs for runs in map(block_runs, blocks) if "".join(run[0] for run in runs).strip()]
+    if paragraphs:
+        return paragraphs
+    return [[(paragraph.strip(), False, False)] for paragraph in (ocr_text or '').split('\n\n') if paragraph.strip()]
+
+
+def block_runs(block):
+    """(text, bold, italic) runs of a text block, with its lines joined by spaces and same-style spans merged"""
+    runs = []
+    for line_num, line in enumerate(block['lines']):
+        for span_num, span in enumerate(line):
+            text = span['text']
+            if line_num and not span_num:
+                text = " " + text
+            style = (bool(span['flags'] & fitz.TEXT_FONT_BOLD), bool(span['flags'] & fitz.TEXT_FONT_ITALIC))
+            if runs and runs[-1][1:] == style:
+                runs[-1] = (runs[-1][0] + text,) + style
+            else:
+                runs.append((text,) + style)
+    return runs
+
+
+def word_page_dpi(page):
+    """Render resolution giving WORD_IMAGE_PPI when the page is shown 6 inches wide, rounded up to a standard DPI"""
+    target = WORD_IMAGE_PPI * 6.0 / (page.rect.width / 72)
+    return next((dpi for dpi in STANDARD_RENDER_DPIS if dpi >= target), math.ceil(target))
+
+
+def word_page_format(page):
+    """'jpeg' for pages that are mostly images (photos, scans), 'png8' for text and line art"""
+    return 'jpeg' if page_image_share(page) >= WORD_JPEG_MIN_IMAGE_SHARE else 'png8'
+
+
+def page_image_share(page):
+    """Share of the page's area covered by images"""
+    page_area = abs(page.rect)
+    if not page_area:
+        return 0
+    covered = sum(abs(fitz.Rect(info['bbox']) & page.rect) for info in page.get_image_info())
+    return min(1.0, covered / page_area)
+
+
+def add_hybrid_page(doc, page, blocks, ocr_text=None):
+    """Add a page as native paragraphs plus pictures of its image regions in reading order, then any ocr_text"""
+    # Text blocks and image xrefs, each with its position on the page
+    items = [(block['bbox'], block) for block in blocks]
+    items += [(info['bbox'], info['xref']) for info in page.get_image_info(xrefs=True)]
+    for bbox, content in sorted(items, key=lambda item: (round(item[0][1]), item[0][0])):
+        if isinstance(content, dict):
+            # Lines within a block wrap one paragraph
+            doc.add_paragraph(" ".join("".join(span['text'] for span in line) for line in content['lines']))
+            continue
+
+        clip = fitz.Rect(bbox) & page.rect
+        if clip.is_empty:
+            continue
+        # Shown at its size on the page, at most the 6-inch text width
+        width_inches = min(6.0, clip.width / 72)
+        zoom = WORD_IMAGE_PPI * width_inches / clip.width
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, colorspace=fitz.csRGB, alpha=False)
+        # Images stored as JPEG stay JPEG; lossless ones (diagrams, logos) become
+        # palette PNGs when they fit a palette
+        image = pixmap_image(pix)
+        filters = page.parent.xref_get_key(content, 'Filter')[1] if content > 0 else ''
+        if 'DCTDecode' in filters or 'JPXDecode' in filters or image.getcolors(256) is None:
+            image_format = 'jpeg'
+        else:
+            image_format = 'png8'
+        doc.add_picture(io.BytesIO(encode_image(image, image_format, WORD_JPEG_QUALITY)), width=Inches(width_inches))
+
+    for paragraph in (ocr_text or '').split('\n\n'):
+        if paragraph.strip():
+            doc.add_paragraph(paragraph.strip())
+
+
+def ocr_pages(doc, input_path, page_numbers, language, progress=None):
+    """OCR the given pages on a process pool, returning {page_num: text} (cached by page content)"""
+    texts = {}
+    pending = []
+    for page_num in page_numbers:
+        cache_key = result_cache_key('ocr-page', [page_content_hash(doc.load_page(page_num))], {
+            'lang': language,
+            'dpi': OCR_DPI
+        })
+        cached_path, _ = result_cache.get(cache_key)
+        try:
+            with open(cached_path, 'rb') as f:
+                texts[page_num] = f.read().decode('utf-8')
+        except (TypeError, OSError):
+            pending.append((page_num, cache_key))
+    if not pending:
+        return texts
+
+    # Raises TesseractNotFoundError when there is work but no tesseract
+    pytesseract.get_tesseract_version()
+    workers = max(1, min(OCR_WORKERS, len(pending)))
+    print(f"Running OCR on {len(pending)} pages with {workers} workers ({len(texts)} cached)")
+
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_image_worker, initargs=(input_path,))
+        recognize = partial(_ocr_worker_page, language=language)
+    else:
+        recognize = lambda item: ocr_page(doc, item[0], language)
+    try:
+        for done, ((page_num, cache_key), text) in enumerate(ordered_map(recognize, pending, executor, window=workers * 2), 1):
+            # Pages tesseract failed on are left out (and not cached)
+            if text is not None:
+                texts[page_num] = text
+                result_cache.put_bytes(cache_key, text.encode('utf-8'))
+            if progress:
+                progress(len(page_numbers) - len(pending) + done, len(page_numbers))
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    return texts
+
+
+def ocr_page(doc, page_num, language):
+    """Render a page in grayscale at OCR_DPI and recognize its text with tesseract (None if that fails)"""
+    try:
+        pix = render_page_pixmap(doc.load_page(page_num), OCR_DPI, grayscale=True)
+        with ocr_slots.slot():
+            return pytesseract.image_to_string(pixmap_image(pix), lang=language).strip()
+    except pytesseract.TesseractNotFoundError:
+        raise
     except Exception as e:
-        print(f"Error during PDF to Word conversion: {e}")
-        return jsonify({"success": False, "message": f"Conversion failed: {str(e)}"}), 500
+        print(f"OCR failed on page {page_num + 1}: {e}")
+        return None
+
+
+def _ocr_worker_page(item, language):
+    """Pool entry point: OCR one (page_num, cache_key) item from the worker's own copy of the document"""
+    return ocr_page(_image_worker_doc, item[0], language)
+
+
+def page_content_hash(page):
+    """SHA-256 over what a page draws: its size, content stream, form XObjects and images"""
+    doc = page.parent
+    digest = hashlib.sha256(f"{tuple(page.rect)} {page.rotation}".encode())
+    digest.update(page.read_contents())
+    xrefs = {xobject[0] for xobject in page.get_xobjects()} | {image[0] for image in page.get_images(full=True)}
+    for xref in sorted(xrefs):
+        digest.update(doc.xref_stream_raw(xref) or b'')
+    return digest.hexdigest()
+
+
+def page_draws_text(page):
+    """Whether a page has fonts and text operators in its content or form XObjects, checked without extracting text"""
+    if not page.get_fonts():
+        return False
+    doc = page.parent
+    streams = [page.read_contents()] + [doc.xref_stream(xobject[0]) or b'' for xobject in page.get_xobjects()]
+    return any(b'BT' in stream for stream in streams)
+
+
+def extract_page_text(page):
+    """A page's text blocks in reading order from one extraction pass, as {'bbox', 'lines': [[span, ...], ...]}"""
+    blocks = []
+    for block in page.get_text('dict', flags=fitz.TEXTFLAGS_TEXT, sort=True)['blocks']:
+        lines = []
+        for line in block.get('lines', []):
+            spans = [
+                {'text': span['text'], 'font': span['font'], 'size': span['size'], 'flags': span['flags']}
+                for span in line['spans'] if span['text']
+            ]
+            if spans:
+                lines.append(spans)
+        if lines:
+            blocks.append({'bbox': block['bbox'], 'lines': lines})
+    return blocks
+
+
+def blocks_to_text(blocks):
+    """Plain text of extract_page_text's blocks, one output line per text line"""
+    return "\n".join(
+        "".join(span['text'] for span in line)
+        for block in blocks
+        for line in block['lines']
+    )
 
 
 if __name__ == '__main__':
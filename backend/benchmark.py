@@ -0,0 +1,387 @@
+"""Benchmark suite for the document conversion pipelines.
+
+Builds a synthetic corpus locally, runs every pipeline/preset against it and
+reports pages/s, MB/s, peak RSS and output/input ratio. Each case runs in its
+own subprocess so peak RSS is per case.
+
+    python benchmark.py                      # run and compare against the baseline
+    python benchmark.py --save-baseline      # run and store the results as the new baseline
+    python benchmark.py --filter compress    # only cases whose id contains "compress"
+
+Exits with status 1 when a case is slower (or uses more memory) than the
+baseline by more than --tolerance, so it can gate a deploy. Timings are
+machine-specific, so save the baseline on the hardware it will be compared on.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw, ImageFilter
+
+# Bump when the corpus changes so stale copies are rebuilt
+CORPUS_VERSION = 1
+CORPUS_SEED = 1234
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+LOREM = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt "
+    "ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco "
+    "laboris nisi ut aliquip ex ea commodo consequat. Duis aute irure dolor in reprehenderit in "
+    "voluptate velit esse cillum dolore eu fugiat nulla pariatur. "
+)
+
+PDF_DOCUMENTS = ['text', 'scan', 'mixed', 'many-pages', 'huge-image']
+IMAGE_BATCHES = ['batch-jpeg', 'batch-png']
+
+
+# --- Synthetic corpus ---
+
+def synthetic_photo(rng, width, height, grayscale=False):
+    """A deterministic photo-like image: gradients, soft shapes and a little grain"""
+    image = Image.linear_gradient('L').resize((width, height))
+    if not grayscale:
+        image = Image.merge('RGB', (
+            image,
+            image.rotate(90).resize((width, height)),
+            Image.linear_gradient('L').transpose(Image.FLIP_TOP_BOTTOM).resize((width, height))
+        ))
+    draw = ImageDraw.Draw(image)
+    for _ in range(24):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(min(width, height) // 20, min(width, height) // 4)
+        fill = rng.randrange(256) if grayscale else tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=fill)
+    image = image.filter(ImageFilter.GaussianBlur(4))
+
+    grain = Image.frombytes('L', (width, height), rng.randbytes(width * height))
+    if not grayscale:
+        grain = grain.convert('RGB')
+    return Image.blend(image, grain, 0.08)
+
+
+def image_bytes(image, fmt, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+def add_text(page, rng, paragraphs=6, rect=None):
+    text = "\n\n".join(LOREM * rng.randrange(1, 4) for _ in range(paragraphs))
+    page.insert_textbox(rect or fitz.Rect(50, 50, page.rect.width - 50, page.rect.height - 50), text, fontsize=10)
+
+
+def build_pdf(name, path, rng):
+    doc = fitz.open()
+    if name == 'text':
+        # 40 pages of plain text
+        for _ in range(40):
+            add_text(doc.new_page(), rng)
+    elif name == 'scan':
+        # 12 full-page grayscale JPEG "scans" at ~200 DPI, no text layer
+        for _ in range(12):
+            page = doc.new_page()
+            scan = synthetic_photo(rng, 1650, 2200, grayscale=True)
+            page.insert_image(page.rect, stream=image_bytes(scan, 'JPEG', quality=90))
+    elif name == 'mixed':
+        # 20 pages of text with a PNG photo and a logo shared by every page
+        logo = image_bytes(synthetic_photo(rng, 400, 400), 'PNG')
+        for _ in range(20):
+            page = doc.new_page()
+            add_text(page, rng, paragraphs=2, rect=fitz.Rect(50, 420, 545, 800))
+            photo = synthetic_photo(rng, 1600, 1100)
+            page.insert_image(fitz.Rect(50, 50, 545, 390), stream=image_bytes(photo, 'PNG'))
+            page.insert_image(fitz.Rect(500, 800, 540, 840), stream=logo)
+    elif name == 'many-pages':
+        # 300 short pages with a small image on every tenth one
+        for i in range(300):
+            page = doc.new_page()
+            add_text(page, rng, paragraphs=1)
+            if i % 10 == 0:
+                small = synthetic_photo(rng, 600, 400)
+                page.insert_image(fitz.Rect(50, 600, 350, 800), stream=image_bytes(small, 'JPEG', quality=85))
+    elif name == 'huge-image':
+        # A single page holding one 6000x4500 photo
+        page = doc.new_page()
+        huge = synthetic_photo(rng, 6000, 4500)
+        page.insert_image(page.rect, stream=image_bytes(huge, 'JPEG', quality=92))
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+
+
+def build_image_batch(name, directory, rng):
+    os.makedirs(directory, exist_ok=True)
+    if name == 'batch-jpeg':
+        for i in range(12):
+            photo = synthetic_photo(rng, 3000, 2000)
+            with open(os.path.join(directory, f'photo_{i + 1}.jpg'), 'wb') as f:
+                f.write(image_bytes(photo, 'JPEG', quality=90))
+    elif name == 'batch-png':
+        for i in range(6):
+            photo = synthetic_photo(rng, 2000, 1500)
+            with open(os.path.join(directory, f'screen_{i + 1}.png'), 'wb') as f:
+                f.write(image_bytes(photo, 'PNG'))
+
+
+def ensure_corpus(corpus_dir):
+    """Build the corpus if this version of it isn't there yet"""
+    marker = os.path.join(corpus_dir, f'.version-{CORPUS_VERSION}')
+    if os.path.exists(marker):
+        return
+    print(f"Building synthetic corpus in {corpus_dir}...")
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    os.makedirs(corpus_dir)
+    for name in PDF_DOCUMENTS:
+        started = time.perf_counter()
+        build_pdf(name, os.path.join(corpus_dir, f'{name}.pdf'), random.Random(f'{CORPUS_SEED}-{name}'))
+        print(f"  {name}.pdf ({time.perf_counter() - started:.1f}s)")
+    for name in IMAGE_BATCHES:
+        build_image_batch(name, os.path.join(corpus_dir, name), random.Random(f'{CORPUS_SEED}-{name}'))
+        print(f"  {name}/")
+    open(marker, 'w').close()
+
+
+# --- Cases ---
+
+def build_cases():
+    """(case id, spec) for every pipeline, preset and corpus entry"""
+    cases = []
+    for document in PDF_DOCUMENTS:
+        for level in ['low', 'medium', 'high', 'extreme']:
+            cases.append((f'compress-advanced/{level}/{document}', {'kind': 'compress-advanced', 'input': document, 'level': level}))
+        for level in ['high', 'extreme']:
+            cases.append((f'compress-fallback/{level}/{document}', {'kind': 'compress-fallback', 'input': document, 'level': level}))
+        for fmt in ['png', 'jpeg']:
+            cases.append((f'pdf-to-images/{fmt}-150/{document}', {'kind': 'pdf-to-images', 'input': document, 'format': fmt, 'dpi': 150}))
+        # Scanned and image-only documents have no text layer for text-only mode
+        layouts = ['full', 'hybrid'] if document in ('scan', 'huge-image') else ['full', 'hybrid', 'text']
+        for layout in layouts:
+            cases.append((f'pdf-to-word/{layout}/{document}', {'kind': 'pdf-to-word', 'input': document, 'layout': layout}))
+    for batch in IMAGE_BATCHES:
+        for fit in ['fit', 'fill']:
+            cases.append((f'images-to-pdf/a4-{fit}/{batch}', {'kind': 'images-to-pdf', 'input': batch, 'fit': fit}))
+    return cases
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and of any worker processes it waited for, in MB"""
+    own_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        # Linux carries ru_maxrss across exec, so the parent's peak would leak into
+        # every case; VmHWM belongs to this process's own address space
+        with open('/proc/self/status') as f:
+            own_peak = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+    except (OSError, StopIteration):
+        pass
+    peak = max(own_peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(spec, corpus_dir):
+    """Run one case in this process and return its measurements"""
+    # Measure the pipelines themselves, not the result or rendered-page caches
+    os.environ['RESULT_CACHE_MAX_MB'] = '0'
+    os.environ['PAGE_CACHE_MAX_MB'] = '0'
+    import app as app_module
+
+    workdir = tempfile.mkdtemp(prefix='oneclick_bench_')
+    try:
+        kind = spec['kind']
+        if kind == 'images-to-pdf':
+            batch_dir = os.path.join(corpus_dir, spec['input'])
+            input_paths = [os.path.join(batch_dir, name) for name in sorted(os.listdir(batch_dir))]
+            pages = len(input_paths)
+        else:
+            input_paths = [os.path.join(corpus_dir, f"{spec['input']}.pdf")]
+            with fitz.open(input_paths[0]) as doc:
+                pages = doc.page_count
+        input_bytes = sum(os.path.getsize(path) for path in input_paths)
+
+        started = time.perf_counter()
+        if kind == 'compress-advanced':
+            output_path = app_module.compress_pdf_advanced(input_paths[0], os.path.join(workdir, 'out.pdf'), spec['level'])
+        elif kind == 'compress-fallback':
+            output_path = app_module.compress_pdf_fallback(input_paths[0], os.path.join(workdir, 'out.pdf'), spec['level'])
+        elif kind == 'pdf-to-images':
+            result = app_module.run_pdf_to_images(input_paths[0], workdir, 'bench.pdf', spec['format'], 90, spec['dpi'], 'zip')
+            output_path = result['content']
+        elif kind == 'pdf-to-word':
+            result = app_module.run_pdf_to_word(input_paths[0], workdir, 'bench.pdf', spec['layout'])
+            output_path = result['content']
+        elif kind == 'images-to-pdf':
+            # This pipeline only exists as an endpoint, so drive it through the test client
+            client = app_module.app.test_client()
+            with client.session_transaction() as session:
+                session['user'] = {'id': 'benchmark', 'email': 'benchmark@example.com', 'full_name': 'Benchmark'}
+            files = [(open(path, 'rb'), os.path.basename(path)) for path in input_paths]
+            response = client.post('/api/convert-images-to-pdf', data={
+                'images': files,
+                'pageSize': 'A4',
+                'imageFit': spec['fit']
+            }, content_type='multipart/form-data')
+            if response.status_code != 200:
+                raise RuntimeError(f"images-to-pdf returned {response.status_code}")
+            output_path = os.path.join(workdir, 'out.pdf')
+            with open(output_path, 'wb') as f:
+                f.write(response.get_data())
+            response.close()
+        else:
+            raise ValueError(f"Unknown case kind: {kind}")
+        elapsed = time.perf_counter() - started
+
+        return {
+            'seconds': elapsed,
+            'pages': pages,
+            'input_bytes': input_bytes,
+            'output_bytes': os.path.getsize(output_path),
+            'pages_per_second': pages / elapsed,
+            'mb_per_second': input_bytes / (1024 * 1024) / elapsed,
+            'peak_rss_mb': peak_rss_mb(),
+            'ratio': os.path.getsize(output_path) / input_bytes
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_case_subprocess(case_id, corpus_dir, repeat, verbose):
+    """Run a case in fresh subprocesses, keeping the fastest run (peak RSS is the max across runs)"""
+    best = None
+    peak = 0
+    for _ in range(repeat):
+        fd, result_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run-case', case_id, '--corpus', corpus_dir, '--result-file', result_path],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stdout=None if verbose else subprocess.DEVNULL,
+                stderr=None if verbose else subprocess.PIPE,
+                text=True
+            )
+            if completed.returncode != 0:
+                return {'error': (completed.stderr or '').strip().splitlines()[-1:] or ['failed']}
+            with open(result_path) as f:
+                result = json.load(f)
+        finally:
+            os.remove(result_path)
+        peak = max(peak, result['peak_rss_mb'])
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    best['peak_rss_mb'] = peak
+    return best
+
+
+# --- Reporting ---
+
+def compare(results, baseline, tolerance):
+    """Regressions of results against baseline: list of (case id, message)"""
+    regressions = []
+    for case_id, result in results.items():
+        previous = baseline.get(case_id)
+        if not previous or 'error' in result or 'error' in previous:
+            continue
+        if result['seconds'] > previous['seconds'] * (1 + tolerance):
+            regressions.append((case_id, f"time {previous['seconds']:.2f}s -> {result['seconds']:.2f}s"))
+        if result['peak_rss_mb'] > previous['peak_rss_mb'] * (1 + tolerance):
+            regressions.append((case_id, f"peak RSS {previous['peak_rss_mb']:.0f}MB -> {result['peak_rss_mb']:.0f}MB"))
+        if result['ratio'] > previous['ratio'] * (1 + tolerance):
+            regressions.append((case_id, f"ratio {previous['ratio']:.3f} -> {result['ratio']:.3f}"))
+    return regressions
+
+
+def print_row(case_id, result, previous):
+    if 'error' in result:
+        print(f"{case_id:<44} ERROR {' '.join(result['error'])}")
+        return
+    change = ''
+    if previous and 'error' not in previous:
+        change = f"{(result['seconds'] / previous['seconds'] - 1) * 100:+6.1f}%"
+    print(
+        f"{case_id:<44} {result['seconds']:>8.2f} {result['pages_per_second']:>8.1f} "
+        f"{result['mb_per_second']:>8.2f} {result['peak_rss_mb']:>8.0f} {result['ratio']:>7.3f} {change:>8}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the document conversion pipelines")
+    parser.add_argument('--corpus', default=os.path.join(tempfile.gettempdir(), 'oneclick_bench_corpus'),
+                        help="Directory for the synthetic corpus (built on first use)")
+    parser.add_argument('--filter', default='', help="Only run cases whose id contains this text")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per case; the fastest is kept")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline results file")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Allowed slowdown before a case counts as a regression")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    parser.add_argument('--verbose', action='store_true', help="Show the pipelines' own output")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    cases = dict(build_cases())
+
+    if args.run_case:
+        result = run_case(cases[args.run_case], args.corpus)
+        with open(args.result_file, 'w') as f:
+            json.dump(result, f)
+        return 0
+
+    ensure_corpus(args.corpus)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get('results', {})
+
+    print(f"{'case':<44} {'seconds':>8} {'pages/s':>8} {'MB/s':>8} {'RSS MB':>8} {'ratio':>7} {'vs base':>8}")
+    results = {}
+    for case_id in cases:
+        if args.filter not in case_id:
+            continue
+        results[case_id] = run_case_subprocess(case_id, args.corpus, max(1, args.repeat), args.verbose)
+        print_row(case_id, results[case_id], baseline.get(case_id))
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'cpu_count': os.cpu_count(),
+        'corpus_version': CORPUS_VERSION,
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        # Keep baseline entries for cases that weren't run this time
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                previous_report = json.load(f)
+            report['results'] = {**previous_report.get('results', {}), **results}
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not baseline:
+        print("No baseline to compare against; run with --save-baseline to create one.")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for case_id, message in regressions:
+        print(f"REGRESSION {case_id}: {message}")
+    if not regressions:
+        print(f"No regressions beyond {args.tolerance:.0%} of the baseline.")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
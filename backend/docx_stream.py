@@ -0,0 +1,77 @@
+import os
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+import docx
+
+
+# python-docx's own blank document, so streamed output is styled like its output
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(docx.__file__), 'templates', 'default.docx')
+
+DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><w:body>'
+)
+DOCUMENT_END = (
+    '<w:sectPr><w:pgSz w:w="12240" w:h="15840"/>'
+    '<w:pgMar w:top="1440" w:right="1800" w:bottom="1440" w:left="1800" w:header="720" w:footer="720" w:gutter="0"/>'
+    '<w:cols w:space="720"/></w:sectPr></w:body></w:document>'
+)
+PAGE_BREAK = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+
+# Characters XML 1.0 can't carry (PDF text extraction can produce control characters)
+_INVALID_XML_CHARS = re.compile('[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]')
+
+
+class StreamingDocxWriter:
+    """Writes a .docx front to back, streaming word/document.xml as paragraphs are added.
+
+    Only the current paragraph is held in memory, and fileobj doesn't need to
+    be seekable. All other parts are copied from template_path. Use it as a
+    context manager, or call close() to finish the document.
+    """
+
+    def __init__(self, fileobj, template_path=DEFAULT_TEMPLATE):
+        self._zip = zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED)
+        with zipfile.ZipFile(template_path) as template:
+            for name in template.namelist():
+                if name != 'word/document.xml':
+                    self._zip.writestr(name, template.read(name))
+        self._body = self._zip.open('word/document.xml', 'w')
+        self._write(DOCUMENT_START)
+
+    def _write(self, xml):
+        self._body.write(xml.encode('utf-8'))
+
+    def add_paragraph(self, runs):
+        """Add a paragraph made of (text, bold, italic) runs"""
+        parts = ['<w:p>']
+        for text, bold, italic in runs:
+            text = _INVALID_XML_CHARS.sub('', text)
+            if not text:
+                continue
+            parts.append('<w:r>')
+            if bold or italic:
+                parts.append('<w:rPr>' + ('<w:b/>' if bold else '') + ('<w:i/>' if italic else '') + '</w:rPr>')
+            parts.append(f'<w:t xml:space="preserve">{escape(text)}</w:t></w:r>')
+        parts.append('</w:p>')
+        self._write(''.join(parts))
+
+    def add_page_break(self):
+        self._write(PAGE_BREAK)
+
+    def close(self):
+        if self._body is None:
+            return
+        self._write(DOCUMENT_END)
+        self._body.close()
+        self._body = None
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
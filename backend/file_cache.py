@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+def hash_file(path):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(namespace, digests, params=None):
+    """Build a cache key from a namespace, input content digests and normalized parameters"""
+    key = hashlib.sha256(namespace.encode())
+    for digest in digests:
+        key.update(digest.encode())
+    key.update(json.dumps(params or {}, sort_keys=True).encode())
+    return key.hexdigest()
+
+
+class DiskCache:
+    """Size-capped on-disk cache with LRU eviction and a TTL.
+
+    Entries are plain files named after their key, with a small JSON sidecar
+    for metadata. Writes go through a temp file and os.replace, so several
+    worker processes can share one directory.
+    """
+
+    def __init__(self, directory, max_bytes, ttl=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = max_bytes > 0
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    def _data_path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Return (path, meta) for a fresh entry, or (None, None) on a miss"""
+        if not self.enabled or not key:
+            return None, None
+
+        path = self._data_path(key)
+        try:
+            with open(self._meta_path(key)) as f:
+                meta = json.load(f)
+            if self.ttl and time.time() - meta.get('created', 0) > self.ttl:
+                self.delete(key)
+                return None, None
+            # Touch the entry so eviction treats it as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None, None
+
+        return path, meta
+
+    def put_bytes(self, key, data, meta=None):
+        """Store bytes under key, returning (path, meta) or (None, None) if caching is off or fails"""
+        return self._put(key, lambda f: f.write(data), meta)
+
+    def put_file(self, key, src_path, meta=None):
+        """Move an existing file into the cache, returning (path, meta) or (None, None)"""
+        if not self.enabled or not key:
+            return None, None
+        try:
+            stored_meta = self._write_meta(key, src_path, meta)
+            os.replace(src_path, self._data_path(key))
+        except OSError:
+            # Most likely a different filesystem: fall back to copying the file in
+            def copy(f):
+                with open(src_path, 'rb') as src:
+                    shutil.copyfileobj(src, f, 1024 * 1024)
+            return self._put(key, copy, meta)
+        self.evict()
+        return self._data_path(key), stored_meta
+
+    def _put(self, key, write, meta):
+        if not self.enabled or not key:
+            return None, None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    write(f)
+                meta = self._write_meta(key, tmp_path, meta)
+                os.replace(tmp_path, self._data_path(key))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except OSError as e:
+            print(f"Cache store failed for {key[:12]}: {e}")
+            return None, None
+        self.evict()
+        return self._data_path(key), meta
+
+    def _write_meta(self, key, data_path, meta):
+        meta = dict(meta or {})
+        meta['created'] = time.time()
+        # A strong validator for the exact bytes being stored
+        meta['etag'] = hash_file(data_path)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path(key))
+        return meta
+
+    def delete(self, key):
+        for path in (self._data_path(key), self._meta_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until the cache fits max_bytes"""
+        entries = []
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith('.tmp'):
+                # Leftovers from writers that died mid-write
+                if now - stat.st_mtime > 3600:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                continue
+            if not name.endswith('.bin'):
+                continue
+            key = name[:-4]
+            # Entries idle for longer than the TTL are necessarily expired
+            if self.ttl and now - stat.st_mtime > self.ttl:
+                self.delete(key)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, key))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.delete(key)
+            total -= size
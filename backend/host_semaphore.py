@@ -0,0 +1,47 @@
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Not on POSIX; the limit is not enforced
+    fcntl = None
+
+
+class HostSemaphore:
+    """Limits how many processes on this host run something at once.
+
+    Each of the slots is a lock file in directory; holding an flock on one
+    is holding the slot. The kernel drops the lock when its holder exits, so
+    a crashed process can't leak a slot.
+    """
+
+    def __init__(self, directory, slots, poll_interval=0.1):
+        self.directory = directory
+        self.slots = max(1, slots)
+        self.poll_interval = poll_interval
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def slot(self):
+        """Block until a slot is free and hold it for the duration of the with block"""
+        fd = self._acquire()
+        try:
+            yield
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _acquire(self):
+        if fcntl is None:
+            return None
+        while True:
+            for slot in range(self.slots):
+                fd = os.open(os.path.join(self.directory, f'slot-{slot}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    os.close(fd)
+                    continue
+                return fd
+            time.sleep(self.poll_interval)
@@ -0,0 +1,220 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+
+
+class JobCancelled(BaseException):
+    """Raised from a job's progress callback once the job has been cancelled.
+
+    It derives from BaseException so the broad `except Exception` fallbacks in
+    the processing code let it through instead of carrying on.
+    """
+
+
+class JobQueueFull(Exception):
+    """Raised when a worker process already has max_pending unfinished jobs"""
+
+
+def read_job_state(job_dir):
+    """Load a job's state, or None if it doesn't exist (yet)"""
+    try:
+        with open(os.path.join(job_dir, 'job.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_job_state(job_dir, **changes):
+    """Merge changes into a job's state file, writing it atomically"""
+    state = read_job_state(job_dir) or {}
+    state.update(changes)
+    state['updated'] = time.time()
+
+    fd, tmp_path = tempfile.mkstemp(dir=job_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, os.path.join(job_dir, 'job.json'))
+    return state
+
+
+class JobProgress:
+    """Progress callback handed to a job as progress(done, total).
+
+    Records progress in the job state (at most every min_interval seconds)
+    and raises JobCancelled once the job has been cancelled.
+    """
+
+    def __init__(self, job_dir, min_interval=0.5):
+        self.job_dir = job_dir
+        self.min_interval = min_interval
+        self._last_write = 0
+
+    def cancelled(self):
+        return os.path.exists(os.path.join(self.job_dir, 'cancel'))
+
+    def __call__(self, done, total):
+        if self.cancelled():
+            raise JobCancelled()
+        now = time.time()
+        if done >= total or now - self._last_write >= self.min_interval:
+            write_job_state(self.job_dir, progress={'done': done, 'total': total})
+            self._last_write = now
+
+
+def _run_job(job_dir, func, args, kwargs):
+    """Process pool entry point: run func(*args, progress=..., **kwargs) and record the outcome"""
+    progress = JobProgress(job_dir)
+    if progress.cancelled():
+        write_job_state(job_dir, status='cancelled', finished=time.time())
+        return
+
+    write_job_state(job_dir, status='running', started=time.time())
+    try:
+        result = func(*args, progress=progress, **kwargs)
+
+        # Results served from the shared result cache can be evicted before the
+        # client fetches them, so the job keeps its own copy
+        content = result.get('content')
+        if isinstance(content, str) and os.path.dirname(os.path.abspath(content)) != os.path.abspath(job_dir):
+            kept_path = os.path.join(job_dir, 'result' + os.path.splitext(result.get('download_name', ''))[1])
+            shutil.copyfile(content, kept_path)
+            result['content'] = kept_path
+
+        write_job_state(job_dir, status='done', result=result, finished=time.time())
+    except JobCancelled:
+        print(f"Job {os.path.basename(job_dir)} cancelled")
+        write_job_state(job_dir, status='cancelled', finished=time.time())
+    except Exception as e:
+        print(f"Job {os.path.basename(job_dir)} failed: {e}")
+        write_job_state(job_dir, status='failed', error=str(e), finished=time.time())
+
+
+class JobQueue:
+    """Runs jobs on a local process pool, with each job's files and state in its own directory.
+
+    Job state lives on disk, so any web worker can report on or cancel any job.
+    The pool and the queue bound are per web worker process. Finished jobs,
+    and jobs that stop reporting, are removed once they are older than ttl.
+    """
+
+    def __init__(self, directory, workers, max_pending, ttl):
+        self.directory = directory
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.ttl = ttl
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def job_dir(self, job_id):
+        """Directory of a job, or None for an id that can't be one of ours"""
+        if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+            return None
+        return os.path.join(self.directory, job_id)
+
+    def create(self, kind, owner):
+        """Reserve a job and its directory; raises JobQueueFull when this worker is at capacity"""
+        self.expire()
+        with self._lock:
+            self._futures = {job_id: future for job_id, future in self._futures.items() if not future.done()}
+            if len(self._futures) >= self.max_pending:
+                raise JobQueueFull()
+
+        job_id = uuid.uuid4().hex
+        job_dir = self.job_dir(job_id)
+        os.makedirs(job_dir)
+        write_job_state(
+            job_dir,
+            id=job_id,
+            kind=kind,
+            owner=owner,
+            status='queued',
+            progress={'done': 0, 'total': 0},
+            created=time.time()
+        )
+        return job_id, job_dir
+
+    def submit(self, job_id, func, *args, **kwargs):
+        """Queue func to run in the pool; it receives the job's progress callback as progress="""
+        job_dir = self.job_dir(job_id)
+        with self._lock:
+            for attempt in range(2):
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                try:
+                    self._futures[job_id] = self._executor.submit(_run_job, job_dir, func, args, kwargs)
+                    return
+                except BrokenProcessPool:
+                    # A pool process died (e.g. killed for memory); start a fresh pool
+                    print("Job pool is broken, restarting it")
+                    self._executor = None
+            raise RuntimeError("Could not start the job worker pool")
+
+    def discard(self, job_id):
+        """Remove a job that was created but never submitted"""
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+    def get(self, job_id, owner=None):
+        """A job's state, or None if it doesn't exist, has expired or belongs to someone else"""
+        job_dir = self.job_dir(job_id)
+        state = read_job_state(job_dir) if job_dir else None
+        if state is None or (owner is not None and state.get('owner') != owner):
+            return None
+        if self._expired(state):
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return None
+        return state
+
+    def cancel(self, job_id, owner=None):
+        """Cancel a queued or running job, returning its state (None if not found)"""
+        state = self.get(job_id, owner)
+        if state is None or state.get('status') in FINISHED_STATES:
+            return state
+
+        job_dir = self.job_dir(job_id)
+        # Running jobs notice the marker at their next progress report, and
+        # queued jobs check it before they start
+        open(os.path.join(job_dir, 'cancel'), 'w').close()
+
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            return write_job_state(job_dir, status='cancelled', finished=time.time())
+        return state
+
+    def _expired(self, state):
+        return bool(self.ttl) and time.time() - state.get('updated', 0) > self.ttl
+
+    def expire(self):
+        """Remove finished jobs, and jobs that stopped reporting, older than the TTL"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            job_dir = self.job_dir(name)
+            if job_dir is None:
+                continue
+            state = read_job_state(job_dir)
+            if state is None:
+                # Half-created job; only clean it up once it is clearly abandoned
+                try:
+                    stale = time.time() - os.path.getmtime(job_dir) > (self.ttl or 3600)
+                except OSError:
+                    continue
+                if not stale:
+                    continue
+            elif not self._expired(state):
+                continue
+            shutil.rmtree(job_dir, ignore_errors=True)
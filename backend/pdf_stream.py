@@ -0,0 +1,87 @@
+def _number(value):
+    """Format a coordinate for a PDF content stream (no exponent notation)"""
+    return f'{value:.4f}'.rstrip('0').rstrip('.') or '0'
+
+
+class StreamingImagePdfWriter:
+    """Writes a PDF of one JPEG image per page front to back.
+
+    Each page's image is written out as soon as it is added, so only the
+    current image is held in memory however many pages there are, and
+    fileobj doesn't need to be seekable. Use it as a context manager, or call
+    close() to write the page tree and cross-reference table.
+    """
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self._offset = 0
+        self._object_offsets = {}
+        self._page_ids = []
+        # Objects 1 and 2 (catalog and page tree) are written last, once all pages are known
+        self._next_id = 3
+        self._closed = False
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    @property
+    def page_count(self):
+        return len(self._page_ids)
+
+    def _write(self, data):
+        self._file.write(data)
+        self._offset += len(data)
+
+    def _add_object(self, body, obj_id=None):
+        if obj_id is None:
+            obj_id = self._next_id
+            self._next_id += 1
+        self._object_offsets[obj_id] = self._offset
+        self._write(f'{obj_id} 0 obj\n{body}\nendobj\n'.encode('ascii'))
+        return obj_id
+
+    def _add_stream(self, entries, data):
+        obj_id = self._next_id
+        self._next_id += 1
+        self._object_offsets[obj_id] = self._offset
+        self._write(f'{obj_id} 0 obj\n<< {entries} /Length {len(data)} >>\nstream\n'.encode('ascii'))
+        self._write(data)
+        self._write(b'\nendstream\nendobj\n')
+        return obj_id
+
+    def add_page(self, page_size, jpeg_bytes, image_size, grayscale, rect):
+        """Add a page of page_size points showing a JPEG of image_size pixels at rect (x, y, width, height)"""
+        width, height = image_size
+        colorspace = '/DeviceGray' if grayscale else '/DeviceRGB'
+        image_id = self._add_stream(
+            f'/Type /XObject /Subtype /Image /Width {width} /Height {height} '
+            f'/ColorSpace {colorspace} /BitsPerComponent 8 /Filter /DCTDecode',
+            jpeg_bytes
+        )
+        x, y, draw_width, draw_height = map(_number, rect)
+        content_id = self._add_stream('', f'q {draw_width} 0 0 {draw_height} {x} {y} cm /Im0 Do Q'.encode('ascii'))
+        page_width, page_height = map(_number, page_size)
+        self._page_ids.append(self._add_object(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] '
+            f'/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>'
+        ))
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self._page_ids)
+        self._add_object(f'<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>', obj_id=2)
+        self._add_object('<< /Type /Catalog /Pages 2 0 R >>', obj_id=1)
+
+        xref_offset = self._offset
+        entries = ['0000000000 65535 f \n']
+        entries += [f'{self._object_offsets[obj_id]:010d} 00000 n \n' for obj_id in range(1, self._next_id)]
+        self._write((
+            f'xref\n0 {self._next_id}\n' + ''.join(entries) +
+            f'trailer\n<< /Size {self._next_id} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n'
+        ).encode('ascii'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()